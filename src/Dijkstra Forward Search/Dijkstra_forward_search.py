@@ -1,9 +1,18 @@
-from maze_environment import load_level, show_level, save_level_costs
+from maze_environment import load_level, load_grid_level, cell_index, index_cell, show_level, save_level_costs
 from math import inf, sqrt
 from heapq import heappop, heappush
 
+import numpy
 
-def dijkstras_shortest_path(initial_position, destination, graph, adj):
+SQRT2 = sqrt(2)
+ALL_DIRECTIONS = [(x, y) for x in [-1, 0, 1] for y in [-1, 0, 1] if not (x == 0 and y == 0)]
+
+
+def heuristic(a, b):
+    return sqrt(abs(a[0] - b[0]) + abs(a[1] - b[1]))
+
+
+def dijkstras_shortest_path(initial_position, destination, graph, adj, heuristic=heuristic):
     """ Searches for a minimal cost path through a graph using Dijkstra's algorithm.
 
     Args:
@@ -11,6 +20,7 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
         destination: The end location for the path.
         graph: A loaded level, containing walls, spaces, and waypoints.
         adj: An adjacency function returning cells adjacent to a given cell as well as their respective edge costs.
+        heuristic: The estimated distance between two cells added to the priorities, or None for none.
 
     Returns:
         If a path exits, return a list containing all cells from initial_position to destination.
@@ -30,19 +40,199 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
         # investigate children
         for (child, step_cost) in adj(graph, cell):
             # calculate cost along this path to child
-            cost_to_child = priority + transition_cost(graph, cell, child)
+            cost_to_child = pathcosts[cell] + step_cost
             if child not in pathcosts or cost_to_child < pathcosts[child]:
                 pathcosts[child] = cost_to_child # update the cost
-                p = cost_to_child + heuristic(destination, child) # adding estimated distance
+                p = cost_to_child
+                if heuristic is not None:
+                    p += heuristic(destination, child) # adding estimated distance
                 paths[child] = cell                         # set the backpointer
                 heappush(queue, (p, child))     # put the child on the priority queue
             
     return False
 
+def jps_shortest_path(initial_position, destination, graph):
+    """ Searches for a minimal cost path through a grid level using jump point search.
+
+    Inside areas where every open cell has the same cost, a move only needs to be
+    expanded where a wall forces a turn, so the search jumps along straight and
+    diagonal lines instead of pushing every cell onto the heap. A cell with a
+    neighbor of a different cost stops a jump, and is expanded in all directions
+    like in dijkstras_shortest_path, so the path costs are the same as its.
+
+    Args:
+        initial_position: The flat index of the initial cell.
+        destination: The flat index of the end location.
+        graph: A level loaded with load_grid_level.
+
+    Returns:
+        If a path exits, return a list containing all cells from initial_position to destination.
+        Otherwise, return False.
+
+    """
+    costs = graph['flat_costs']
+    walls = graph['flat_walls']
+    interior = graph['flat_interior']
+    width = graph['width']
+    min_cost = float(graph['costs'][~graph['walls']].min()) if not graph['walls'].all() else 0.
+    goal_y, goal_x = divmod(destination, width)
+
+    def estimate(cell):
+        # octile distance at the cheapest cost, which never overestimates
+        y, x = divmod(cell, width)
+        dx = abs(x - goal_x)
+        dy = abs(y - goal_y)
+        return min_cost * (max(dx, dy) + (SQRT2 - 1) * min(dx, dy))
+
+    stops = straight_jumps(graph)
+
+    def straight_jump(cell, dx, dy):
+        """ Moves from cell in a straight direction until reaching a cell that must be expanded. """
+        step = dy * width + dx
+        stop = stops[dx, dy][cell + step]
+        offset = destination - cell
+        if (offset // step if dx else offset // width * dy) > 0 and \
+                (destination // width == cell // width if dx else offset % width == 0) and \
+                abs(offset) <= abs(stop - cell):
+            return destination, offset // step
+        if walls[stop]:
+            return None, 0
+        return stop, (stop - cell) // step
+
+    def jump(cell, dx, dy):
+        """ Moves from cell in direction (dx, dy) until reaching a cell that must be expanded. """
+        if not (dx and dy):
+            return straight_jump(cell, dx, dy)
+        step = dy * width + dx
+        steps = 0
+        while True:
+            cell += step
+            steps += 1
+            if walls[cell]:
+                return None, 0
+            if cell == destination or not interior[cell]:
+                return cell, steps
+            if (walls[cell - dx] and not walls[cell - dx + dy * width]) or \
+                    (walls[cell - dy * width] and not walls[cell - dy * width + dx]):
+                return cell, steps
+            if straight_jump(cell, dx, 0)[0] is not None or straight_jump(cell, 0, dy)[0] is not None:
+                return cell, steps
+
+    def directions(cell, direction):
+        """ Returns the directions worth jumping in from cell, reached moving in direction. """
+        if direction is None or not interior[cell]:
+            return ALL_DIRECTIONS
+        dx, dy = direction
+        if dx and dy:
+            result = [(dx, 0), (0, dy), (dx, dy)]
+            if walls[cell - dx]:
+                result.append((-dx, dy))
+            if walls[cell - dy * width]:
+                result.append((dx, -dy))
+        elif dx:
+            result = [(dx, 0)]
+            if walls[cell + width]:
+                result.append((dx, 1))
+            if walls[cell - width]:
+                result.append((dx, -1))
+        else:
+            result = [(0, dy)]
+            if walls[cell + 1]:
+                result.append((1, dy))
+            if walls[cell - 1]:
+                result.append((-1, dy))
+        return result
+
+    paths = {initial_position: []}          # maps jump points to the previous jump points on path
+    pathcosts = {initial_position: 0}       # maps jump points to their pathcosts (found so far)
+    arrived = {initial_position: None}      # maps jump points to the direction they were reached in
+    closed = set()
+    queue = []
+    heappush(queue, (estimate(initial_position), initial_position))
+
+    while queue:
+        _, cell = heappop(queue)
+        if cell in closed:
+            continue
+        closed.add(cell)
+        if cell == destination:
+            return expand_jumps(path_to_cell(cell, paths), width)
+
+        cell_cost = costs[cell]
+        for dx, dy in directions(cell, arrived[cell]):
+            child, steps = jump(cell, dx, dy)
+            if child is None or child in closed:
+                continue
+            # every cell after the first step costs the same as the jump point
+            child_cost = costs[child]
+            distance = SQRT2 if dx and dy else 1.
+            cost_to_child = pathcosts[cell] + distance * ((cell_cost + child_cost) / 2 + (steps - 1) * child_cost)
+            if child not in pathcosts or cost_to_child < pathcosts[child]:
+                pathcosts[child] = cost_to_child
+                paths[child] = cell
+                arrived[child] = (dx, dy)
+                heappush(queue, (cost_to_child + estimate(child), child))
+
+    return False
+
+def straight_jumps(level):
+    """ Returns where straight jumps stop in a level loaded with load_grid_level.
+
+    For each straight direction (dx, dy), maps the flat index of every cell to
+    the first cell at or beyond it, in that direction, that is a wall, has a
+    neighbor of a different cost, or has a neighbor that only a move through it
+    reaches optimally. The arrays are built on first use and kept in the level.
+
+    """
+    if 'straight_jumps' not in level:
+        walls = level['walls']
+        stop = ~level['interior']
+        height, width = walls.shape
+        open_cells = ~walls
+        stops = {}
+        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            forced = numpy.zeros_like(walls)
+            if dx:
+                # a wall beside the cell, with the cell beyond it open
+                inner = forced[1:-1, 1:-1]
+                for side in [0, 2]:
+                    inner |= walls[side:height - 2 + side, 1:-1] & open_cells[side:height - 2 + side, 1 + dx:width - 1 + dx]
+            else:
+                inner = forced[1:-1, 1:-1]
+                for side in [0, 2]:
+                    inner |= walls[1:-1, side:width - 2 + side] & open_cells[1 + dy:height - 1 + dy, side:width - 2 + side]
+            flags = stop | forced
+            index = numpy.arange(walls.size).reshape(walls.shape)
+            if dx == 1 or dy == 1:
+                # reversed running minimum of the flagged indices, so each cell finds the next flag
+                marked = numpy.where(flags, index, walls.size)
+                axis = 1 if dx else 0
+                nearest = numpy.flip(numpy.minimum.accumulate(numpy.flip(marked, axis), axis=axis), axis)
+            else:
+                marked = numpy.where(flags, index, -1)
+                nearest = numpy.maximum.accumulate(marked, axis=1 if dx else 0)
+            stops[dx, dy] = nearest.astype(numpy.int32).reshape(-1).data
+        level['straight_jumps'] = stops
+    return level['straight_jumps']
+
+def expand_jumps(jump_points, width):
+    """ Fills in the cells between consecutive jump points, which lie on straight or diagonal lines. """
+    path = jump_points[:1]
+    for a, b in zip(jump_points, jump_points[1:]):
+        ay, ax = divmod(a, width)
+        by, bx = divmod(b, width)
+        step = (by > ay) - (by < ay)
+        step = step * width + (bx > ax) - (bx < ax)
+        path.extend(range(a + step, b + step, step))
+    return path
+
 def path_to_cell(cell, paths):
-    if cell == []:
-        return []
-    return path_to_cell(paths[cell], paths) + [cell]
+    path = []
+    while cell != []:
+        path.append(cell)
+        cell = paths[cell]
+    path.reverse()
+    return path
     
 
 
@@ -71,24 +261,52 @@ def navigation_edges(level, cell):
             res.append((new, transition_cost(level, new, cell)))
     return res
 
+def grid_navigation_edges(level, cell):
+    """ Yields the adjacent cells of a level loaded with load_grid_level and their edge costs.
+
+    Like navigation_edges, but cells are flat indices into the level's arrays, and
+    the wall border of the arrays stands in for bounds checks.
+
+    Args:
+        level: A level loaded with load_grid_level.
+        cell: The flat index of a target location.
+
+    """
+    costs = level['flat_costs']
+    walls = level['flat_walls']
+    cost = costs[cell]
+    for delta, distance in level['steps']:
+        new = cell + delta
+        if not walls[new]:
+            yield new, distance * (cost + costs[new]) / 2
+
+def grid_heuristic(level):
+    """ Returns heuristic for the flat indices of a level loaded with load_grid_level. """
+    def flat_heuristic(a, b):
+        return heuristic(index_cell(level, a), index_cell(level, b))
+    return flat_heuristic
+
 def transition_cost(level, cell, cell2):
     distance = sqrt((cell2[0] - cell[0])**2 + (cell2[1] - cell[1])**2)
     average_cost = (level['spaces'][cell] + level['spaces'][cell2])/2
     return distance * average_cost
 
 
-def test_route(filename, src_waypoint, dst_waypoint):
+def test_route(filename, src_waypoint, dst_waypoint, grid=False, jps=False):
     """ Loads a level, searches for a path between the given waypoints, and displays the result.
 
     Args:
         filename: The name of the text file containing the level.
         src_waypoint: The character associated with the initial waypoint.
         dst_waypoint: The character associated with the destination waypoint.
+        grid: Whether to load the level into arrays with load_grid_level.
+        jps: Whether to search with jps_shortest_path (implies grid).
 
     """
 
     # Load and display the level.
-    level = load_level(filename)
+    grid = grid or jps
+    level = load_grid_level(filename) if grid else load_level(filename)
     show_level(level)
 
     # Retrieve the source and destination coordinates from the level.
@@ -96,16 +314,18 @@ def test_route(filename, src_waypoint, dst_waypoint):
     dst = level['waypoints'][dst_waypoint]
 
     # Search for and display the path from src to dst.
-    path = dijkstras_shortest_path(src, dst, level, navigation_edges)
+    if jps:
+        path = jps_shortest_path(cell_index(level, src), cell_index(level, dst), level)
+    elif grid:
+        path = dijkstras_shortest_path(cell_index(level, src), cell_index(level, dst), level,
+                                       grid_navigation_edges, grid_heuristic(level))
+    else:
+        path = dijkstras_shortest_path(src, dst, level, navigation_edges)
     if path:
         show_level(level, path)
     else:
         print("No path possible!")
 
-def heuristic(a, b):
-    return sqrt(abs(a[0] - b[0]) + abs(a[1] - b[1]))
-
-
 if __name__ == '__main__':
     filename, src_waypoint, dst_waypoint = 'example.txt', 'a','e'
 
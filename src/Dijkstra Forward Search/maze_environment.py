@@ -1,7 +1,10 @@
 # Implements a maze environment containing cells with walls, spaces, and waypoints
 
-from math import inf
+from math import inf, sqrt
 from csv import writer
+from itertools import chain
+
+import numpy
 
 WALL = 'X'
 
@@ -41,6 +44,86 @@ def load_level(filename):
     return level
 
 
+def load_grid_level(filename):
+    """ Loads a level from a given text file into arrays, for mazes too large for load_level.
+
+    The file is read one line at a time into a float32 array of cell costs and a
+    boolean wall mask, both framed by a border of walls so that neighbors never need
+    a bounds check. Cell (i, j) of the text is element [j + 1, i + 1] of the arrays;
+    see cell_index and index_cell for the flat indices the searches work on.
+
+    Args:
+        filename: The name of the txt file containing the maze.
+
+    Returns:
+        The loaded level (dict) containing the costs of the cells (2D float32 array),
+        the walls (2D bool array, True for every cell that is not a space), the
+        interior (2D bool array, True for open cells whose open neighbors all share
+        their cost), flat memoryviews of all three, the row length of the arrays, the flat index offsets and
+        distances of the eight neighbors of a cell (list), and a mapping of waypoints
+        to locations (dict).
+
+    """
+    height = 0
+    width = 0
+    with open(filename, "rb") as f:
+        for line in f:
+            height += 1
+            width = max(width, len(line.rstrip(b'\r\n')))
+
+    costs = numpy.zeros((height + 2, width + 2), dtype=numpy.float32)
+    walls = numpy.ones((height + 2, width + 2), dtype=bool)
+    waypoints = {}
+    with open(filename, "rb") as f:
+        for j, line in enumerate(f):
+            chars = numpy.frombuffer(line.rstrip(b'\r\n'), dtype=numpy.uint8)
+            digits = (chars >= ord('0')) & (chars <= ord('9'))
+            lower = (chars >= ord('a')) & (chars <= ord('z'))
+            row = costs[j + 1, 1:len(chars) + 1]
+            row[digits] = chars[digits] - ord('0')
+            row[lower] = 1.
+            walls[j + 1, 1:len(chars) + 1] = ~(digits | lower)
+            for i in numpy.nonzero(lower)[0].tolist():
+                waypoints[chr(chars[i])] = (i, j)
+
+    # cells whose open neighbors all cost the same as they do, where jump point search may skip ahead
+    interior = ~walls
+    inner = interior[1:-1, 1:-1]
+    for x in [-1, 0, 1]:
+        for y in [-1, 0, 1]:
+            if x or y:
+                neighbor_walls = walls[1 + y:height + 1 + y, 1 + x:width + 1 + x]
+                neighbor_costs = costs[1 + y:height + 1 + y, 1 + x:width + 1 + x]
+                inner &= neighbor_walls | (neighbor_costs == costs[1:-1, 1:-1])
+
+    row_length = width + 2
+    steps = [(y * row_length + x, sqrt(x * x + y * y))
+             for x in [-1, 0, 1] for y in [-1, 0, 1] if not (x == 0 and y == 0)]
+
+    level = {'costs': costs,
+             'walls': walls,
+             'interior': interior,
+             'flat_costs': costs.reshape(-1).data,
+             'flat_walls': walls.reshape(-1).data,
+             'flat_interior': interior.reshape(-1).data,
+             'width': row_length,
+             'steps': steps,
+             'waypoints': waypoints}
+
+    return level
+
+
+def cell_index(level, cell):
+    """ Returns the flat index of cell (i, j) in a level loaded with load_grid_level. """
+    return (cell[1] + 1) * level['width'] + cell[0] + 1
+
+
+def index_cell(level, index):
+    """ Returns the cell (i, j) at a flat index of a level loaded with load_grid_level. """
+    j, i = divmod(index, level['width'])
+    return (i - 1, j - 1)
+
+
 def show_level(level, path=[]):
     """ Displays a level via a print statement.
 
@@ -49,6 +132,10 @@ def show_level(level, path=[]):
         path: A continuous path to be displayed over the level, if provided.
 
     """
+    if 'costs' in level:
+        show_grid_level(level, path)
+        return
+
     xs, ys = zip(*(list(level['spaces'].keys()) + list(level['walls'])))
     x_lo, x_hi = min(xs), max(xs)
     y_lo, y_hi = min(ys), max(ys)
@@ -78,36 +165,90 @@ def show_level(level, path=[]):
     print(''.join(chars))
 
 
-def save_level_costs(level, costs, filename='distance_map.csv'):
-    """ Displays cell costs from an origin point over the given level.
+def show_grid_level(level, path=[]):
+    """ Displays a level loaded with load_grid_level via a print statement.
 
     Args:
         level: The level to be displayed.
-        costs: A dictionary containing a mapping of cells to costs from an origin point.
-        filename: The name of the csv file to be created.
+        path: A continuous path of flat indices to be displayed over the level, if provided.
 
     """
-    xs, ys = zip(*(list(level['spaces'].keys()) + list(level['walls'])))
-    x_lo, x_hi = min(xs), max(xs)
-    y_lo, y_hi = min(ys), max(ys)
+    chars = numpy.where(level['walls'], ord('X'), ord('0') + level['costs'].astype(numpy.uint8))
+    for char, (i, j) in level['waypoints'].items():
+        chars[j + 1, i + 1] = ord(char)
+    chars.reshape(-1)[list(path)] = ord('*')
+    print('\n'.join(bytes(row.astype(numpy.uint8)).decode() for row in chars[1:-1, 1:-1]))
 
-    rows = []
-    for j in range(y_lo, y_hi + 1):
-        row = []
 
-        for i in range(x_lo, x_hi + 1):
-            cell = (i, j)
-            if cell not in costs:
-                row.append(inf)
-            else:
-                row.append(costs[cell])
+def save_level_costs(level, costs, filename='distance_map.csv'):
+    """ Saves cell costs from an origin point over the given level.
+
+    A filename ending in .npy is written as a float32 NumPy array, one row per j
+    like the csv, with inf for cells without a cost. Its values are copied into
+    the file mapped in memory, without building the rows in Python first; read
+    it back with load_level_costs.
+
+    Args:
+        level: The level the costs were computed on, loaded with load_level or load_grid_level.
+        costs: A dictionary containing a mapping of cells to costs from an origin point,
+            with flat indices as cells for a level loaded with load_grid_level.
+        filename: The name of the csv or npy file to be created.
+
+    """
+    if filename.endswith('.npy'):
+        if 'width' in level:
+            # grid levels are framed by a border of walls that isn't part of the text
+            height, width = level['walls'].shape
+            shape = (height - 2, width - 2)
+            cells = numpy.fromiter(costs.keys(), dtype=numpy.int64, count=len(costs))
+            j, i = numpy.divmod(cells, width)
+            j -= 1
+            i -= 1
+        else:
+            def coordinates(cells, count):
+                return numpy.fromiter(chain.from_iterable(cells), dtype=numpy.int64, count=2 * count).reshape(-1, 2)
+
+            bounds = numpy.concatenate([coordinates(level['spaces'], len(level['spaces'])),
+                                        coordinates(level['walls'], len(level['walls']))])
+            x_lo, y_lo = bounds.min(axis=0)
+            x_hi, y_hi = bounds.max(axis=0)
+            shape = (int(y_hi - y_lo) + 1, int(x_hi - x_lo) + 1)
+            cells = coordinates(costs, len(costs))
+            i = cells[:, 0] - x_lo
+            j = cells[:, 1] - y_lo
+
+        array = numpy.lib.format.open_memmap(filename, mode='w+', dtype=numpy.float32, shape=shape)
+        array[...] = inf
+        array[j, i] = numpy.fromiter(costs.values(), dtype=numpy.float32, count=len(costs))
+        array.flush()
+        del array
+        print("Saved file:", filename)
+        return
 
-        rows.append(row)
+    xs, ys = zip(*(list(level['spaces'].keys()) + list(level['walls'])))
+    x_lo, x_hi = min(xs), max(xs)
+    y_lo, y_hi = min(ys), max(ys)
 
     assert '.csv' in filename, 'Error: filename does not contain file type.'
     with open(filename, 'w', newline='') as f:
         csv_writer = writer(f)
-        for row in rows:
-            csv_writer.writerow(row)
+        for j in range(y_lo, y_hi + 1):
+            csv_writer.writerow([costs.get((i, j), inf) for i in range(x_lo, x_hi + 1)])
+
+    print("Saved file:", filename)
+
+
+def load_level_costs(filename):
+    """ Loads a cost map saved by save_level_costs.
 
-    print("Saved file:", filename)
\ No newline at end of file
+    Args:
+        filename: The name of the csv or npy file.
+
+    Returns:
+        A 2D array of the costs, indexed [j, i], with inf for cells without a cost. A npy
+        file is mapped read-only, so opening it doesn't read the whole file.
+
+    """
+    if filename.endswith('.npy'):
+        return numpy.load(filename, mmap_mode='r')
+    return numpy.loadtxt(filename, delimiter=',', ndmin=2)
@@ -0,0 +1,185 @@
+""" Benchmarks the mesh builder and the searches of nm_pathfinder on the shipped maps.
+
+For every input/*.mesh.pickle, and for meshes built from every input image at
+each --mfs value, the searches are run on the same seeded random pairs of
+walkable points, and their latency, boxes expanded and path length are
+reported. Build time and peak memory are reported for each image and
+min_feature_size. Results are written as JSON, so runs can be diffed:
+
+    python nm_benchmark.py --output before.json
+    python nm_benchmark.py --output after.json
+    diff before.json after.json
+
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from math import ceil
+
+import numpy
+from matplotlib.pyplot import imread
+
+import nm_meshbuilder
+import nm_pathfinder
+import nm_search
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+IMAGE_PATTERNS = ('*.png', '*.gif')
+
+
+def array_search(src_p, dest_p, src_box, dest_box, mesh):
+    return nm_search.workspace(mesh).find_path(src_p, dest_p, src_box, dest_box)
+
+
+# searches that can be benchmarked, all called as search(src_p, dest_p, src_box, dest_box, mesh)
+SEARCHES = {
+    'bi_a_star': nm_pathfinder.bi_a_star,
+    'a_star': nm_pathfinder.a_star_shortest_path,
+    'array': array_search,
+    'hpa': nm_pathfinder.hpa_path,
+    'nba': nm_pathfinder.nba_star,
+}
+
+
+def percentile(values, q):
+    """ Returns the nearest-rank q-th percentile of a list of numbers, or None if it is empty. """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, ceil(q / 100 * len(values)) - 1)]
+
+
+def summary(values):
+    """ Returns the p50, p95, p99 and mean of a list of numbers, rounded to keep diffs readable. """
+    stats = {'p50': percentile(values, 50), 'p95': percentile(values, 95),
+             'p99': percentile(values, 99), 'mean': sum(values) / len(values) if values else None}
+    return {key: None if value is None else round(value, 4) for key, value in stats.items()}
+
+
+def random_pairs(mesh, count, seed):
+    """ Returns count pairs of random walkable points, drawn uniformly over the area of the boxes. """
+    rnd = random.Random(seed)
+    boxes = list(mesh['boxes'])
+    areas = [(x2 - x1) * (y2 - y1) for x1, x2, y1, y2 in boxes]
+
+    def point():
+        x1, x2, y1, y2 = rnd.choices(boxes, weights=areas)[0]
+        return (int(rnd.uniform(x1, x2)), int(rnd.uniform(y1, y2)))
+
+    return [(point(), point()) for _ in range(count)]
+
+
+def bench_searches(mesh, pairs, searches):
+    """ Runs each search on every pair, and summarizes latency, boxes expanded and path length.
+
+    Latency covers the search only; the boxes of both points are found first.
+
+    """
+    located = [(a, b, nm_pathfinder.find_box(a, mesh), nm_pathfinder.find_box(b, mesh)) for a, b in pairs]
+    located = [pair for pair in located if pair[2] is not None and pair[3] is not None]
+
+    results = {}
+    for name in searches:
+        search = SEARCHES[name]
+        # warm up caches such as the search workspaces outside of the timings
+        if located:
+            search(*located[0], mesh)
+
+        latencies = []
+        expanded = []
+        lengths = []
+        for src_p, dest_p, src_box, dest_box in located:
+            start = time.perf_counter()
+            path, boxes = search(src_p, dest_p, src_box, dest_box, mesh)
+            latencies.append((time.perf_counter() - start) * 1000)
+            expanded.append(len(boxes) if boxes else 0)
+            if path:
+                lengths.append(sum(nm_pathfinder.euclidean_dist(a, b) for a, b in zip(path, path[1:])))
+
+        results[name] = {'queries': len(located), 'found': len(lengths),
+                         'latency_ms': summary(latencies), 'expanded': summary(expanded),
+                         'path_length': summary(lengths)}
+    return results
+
+
+def load_image(filename):
+    """ Reads a map the way nm_meshbuilder does, as a 2D uint8 array. """
+    image = imread(filename)
+    return nm_meshbuilder.band_pixels(image, 0, image.shape[0])
+
+
+def bench_build(image, min_feature_size, repeat):
+    """ Times build_mesh (best of repeat runs), then measures its peak memory with tracemalloc. """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        mesh = nm_meshbuilder.build_mesh(image, min_feature_size)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    nm_meshbuilder.build_mesh(image, min_feature_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return mesh, {'boxes': len(mesh['boxes']), 'build_s': round(min(times), 4), 'peak_mb': round(peak / 2 ** 20, 2)}
+
+
+def run(input_dir, sizes, pair_count, seed, searches, repeat):
+    report = {
+        'config': {'pairs': pair_count, 'seed': seed, 'min_feature_sizes': sizes,
+                   'searches': searches, 'repeat': repeat},
+        'environment': {'python': platform.python_version(), 'numpy': numpy.__version__,
+                        'machine': platform.machine()},
+        'meshes': {},
+        'builds': {},
+    }
+
+    for filename in sorted(glob.glob(os.path.join(input_dir, '*.mesh.pickle'))):
+        name = os.path.basename(filename)
+        print("searching %s" % name, file=sys.stderr)
+        mesh = nm_pathfinder.load_mesh(filename)
+        pairs = random_pairs(mesh, pair_count, seed)
+        report['meshes'][name] = {'boxes': len(mesh['boxes']), 'searches': bench_searches(mesh, pairs, searches)}
+
+    images = sorted(f for pattern in IMAGE_PATTERNS for f in glob.glob(os.path.join(input_dir, pattern))
+                    if not f.endswith('.mesh.png'))
+    for filename in images:
+        name = os.path.basename(filename)
+        image = load_image(filename)
+        report['builds'][name] = {}
+        for size in sizes:
+            print("building %s with min_feature_size %d" % (name, size), file=sys.stderr)
+            mesh, build = bench_build(image, size, repeat)
+            pairs = random_pairs(mesh, pair_count, seed)
+            build['searches'] = bench_searches(mesh, pairs, searches)
+            report['builds'][name][str(size)] = build
+
+    return report
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmarks nm_meshbuilder and nm_pathfinder on the shipped maps.")
+    parser.add_argument('--input', default=INPUT_DIR, help="directory of maps and .mesh.pickle files")
+    parser.add_argument('--mfs', type=int, nargs='+', default=[8, 16, 32],
+                        help="min_feature_size values to build each image with")
+    parser.add_argument('--pairs', type=int, default=200, help="number of random queries per mesh")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--searches', nargs='+', choices=sorted(SEARCHES), default=['bi_a_star', 'a_star'])
+    parser.add_argument('--repeat', type=int, default=3, help="build each mesh this many times and keep the best time")
+    parser.add_argument('--output', help="JSON file to write (default: standard output)")
+    args = parser.parse_args()
+
+    report = run(args.input, args.mfs, args.pairs, args.seed, args.searches, args.repeat)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
@@ -0,0 +1,126 @@
+""" A content-addressed cache of nm_meshbuilder's output files.
+
+Entries are keyed by a hash of the map's pixels, the min_feature_size, the
+output format and the builder's version, so a map is only rebuilt when one of
+them changes, whatever its file name or modification time. Each entry is a
+directory holding the files a build wrote (the mesh, its label raster and the
+.mesh.png atlas), named by their suffix after the map's file name.
+
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+
+def cache_key(image, min_feature_size, fmt, builder_version):
+    """ Returns the hex digest identifying a build of an image.
+
+    Args:
+        image: The map as a numpy array, as build_mesh receives it.
+        min_feature_size: The min_feature_size of the build.
+        fmt: The output format, 'pickle' or 'arrays'.
+        builder_version: nm_meshbuilder.BUILDER_VERSION.
+
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((builder_version, fmt, min_feature_size, image.shape, image.dtype.str)).encode())
+    digest.update(memoryview(image.copy(order='C')).cast('B'))
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """ The cache entries stored under one directory.
+
+    Args:
+        directory: Where entries are kept; created on first use.
+
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def restore(self, key, filename):
+        """ Copies the files of a cached build next to the map.
+
+        Args:
+            key: The cache_key of the build.
+            filename: The map's file name; a cached '.mesh.png' is written as
+                filename + '.mesh.png'.
+
+        Returns:
+            Whether the cache had the build.
+
+        """
+        entry = self.entry(key)
+        if not os.path.isdir(entry):
+            return False
+        for suffix in os.listdir(entry):
+            shutil.copyfile(os.path.join(entry, suffix), filename + suffix)
+        # the modification time of an entry is when it was last used, for evict
+        os.utime(entry)
+        return True
+
+    def store(self, key, filename, suffixes):
+        """ Adds the files a build wrote next to the map as the entry for key.
+
+        Args:
+            key: The cache_key of the build.
+            filename: The map's file name.
+            suffixes: The suffixes of the files written, e.g. ['.mesh.pickle', '.mesh.png'].
+
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        # fill a temporary directory and rename it, so concurrent runs never see half an entry
+        staging = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        for suffix in suffixes:
+            shutil.copyfile(filename + suffix, os.path.join(staging, suffix))
+        try:
+            os.rename(staging, self.entry(key))
+        except OSError:
+            # another run stored the same build first
+            shutil.rmtree(staging)
+
+    def entries(self):
+        """ Returns (last use, size in bytes, path) for every entry, least recently used first. """
+        if not os.path.isdir(self.directory):
+            return []
+        result = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            result.append((os.path.getmtime(path), size, path))
+        result.sort()
+        return result
+
+    def evict(self, max_bytes=None, max_age=None):
+        """ Removes entries unused for more than max_age seconds, then the least
+        recently used ones until the cache holds at most max_bytes.
+
+        Returns:
+            The number of entries removed.
+
+        """
+        entries = self.entries()
+        removed = 0
+        if max_age is not None:
+            now = time.time()
+            for entry in [e for e in entries if now - e[0] > max_age]:
+                shutil.rmtree(entry[2])
+                entries.remove(entry)
+                removed += 1
+        if max_bytes is not None:
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= max_bytes:
+                    break
+                shutil.rmtree(path)
+                total -= size
+                removed += 1
+        return removed
@@ -0,0 +1,223 @@
+""" Hierarchical (HPA*-style) search over a box mesh.
+
+Boxes are grouped into square regions by the position of their centers. A box
+with a neighbor in another region is an entrance, and the abstract graph links
+entrances of the same region by the cost of the shortest path between them
+inside the region, and entrances of neighboring regions by a single step.
+
+A query connects its two boxes to the entrances of their regions, searches the
+abstract graph, and then refines each abstract edge with a search that never
+leaves one region, so long queries only touch the regions along the way.
+
+"""
+from collections import OrderedDict
+from heapq import heappop, heappush
+from math import sqrt
+
+import nm_meshio
+
+# side, in pixels, of the square regions boxes are grouped into
+REGION_SIZE = 256
+
+
+class Hierarchy:
+    """ The abstract graph of a mesh, built once and reused by every query.
+
+    Costs between adjacent boxes are the distances between their centers.
+
+    Args:
+        mesh: A dict mesh built by nm_meshbuilder, or an ArrayMesh.
+        region_size: Side of the square regions, in pixels.
+
+    """
+
+    def __init__(self, mesh, region_size=REGION_SIZE):
+        mesh = nm_meshio.from_dict(mesh)
+        self.mesh = mesh
+        self.region_size = region_size
+        boxes = mesh.boxes.tolist()
+        offsets = mesh.offsets.tolist()
+        neighbors = mesh.neighbors.tolist()
+        self.boxes = [tuple(box) for box in boxes]
+        self.center_x = [(x1 + x2) / 2 for x1, x2, _, _ in boxes]
+        self.center_y = [(y1 + y2) / 2 for _, _, y1, y2 in boxes]
+        self.adj = [neighbors[offsets[i]:offsets[i + 1]] for i in range(len(boxes))]
+        self.region = [(int(x // region_size), int(y // region_size))
+                       for x, y in zip(self.center_x, self.center_y)]
+
+        region = self.region
+        self.entrances = {}
+        for i, adj in enumerate(self.adj):
+            if any(region[j] != region[i] for j in adj):
+                self.entrances.setdefault(region[i], []).append(i)
+
+        # abstract edges: entrance -> list of (entrance, cost)
+        self.edges = {}
+        for entrances in self.entrances.values():
+            for i in entrances:
+                edges = [(j, self.step(i, j)) for j in self.adj[i] if region[j] != region[i]]
+                dist, _ = self.local_search(i, entrances)
+                edges.extend((j, dist[j]) for j in entrances if j != i and j in dist)
+                self.edges[i] = edges
+
+    def step(self, i, j):
+        """ Returns the cost of moving between two adjacent boxes. """
+        return sqrt((self.center_x[i] - self.center_x[j]) ** 2 + (self.center_y[i] - self.center_y[j]) ** 2)
+
+    def local_search(self, src, targets=None, dest=None):
+        """ Runs Dijkstra's algorithm from src without leaving its region.
+
+        Args:
+            src: Id of the box to start from.
+            targets: Box ids the search may stop after settling all of; by
+                default the whole reachable part of the region is settled.
+            dest: A single box id to stop at, searched with A* instead.
+
+        Returns:
+            The dict of settled box ids to their costs, and the dict of
+            backpointers.
+
+        """
+        region = self.region[src]
+        remaining = len(targets) if targets is not None else -1
+        targets = set(targets) if targets is not None else ()
+        dist = {}
+        back = {src: None}
+        costs = {src: 0.}
+        queue = [(self.estimate(src, dest), 0., src)]
+        while queue:
+            _, cost, cell = heappop(queue)
+            if cell in dist:
+                continue
+            dist[cell] = cost
+            if cell == dest:
+                break
+            if cell in targets:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            for child in self.adj[cell]:
+                if self.region[child] != region or child in dist:
+                    continue
+                cost_to_child = cost + self.step(cell, child)
+                if child not in costs or cost_to_child < costs[child]:
+                    costs[child] = cost_to_child
+                    back[child] = cell
+                    heappush(queue, (cost_to_child + self.estimate(child, dest), cost_to_child, child))
+        return dist, back
+
+    def estimate(self, i, dest):
+        return 0. if dest is None else self.step(i, dest)
+
+    def find_corridor(self, src, dest):
+        """ Searches for a corridor of boxes between two box ids.
+
+        Returns:
+            The list of box ids from src to dest, or None if there is no path,
+            and the list of box ids the search touched.
+
+        """
+        if src == dest:
+            return [src], [src]
+
+        region = self.region
+        src_entrances = self.entrances.get(region[src], [])
+        dest_entrances = self.entrances.get(region[dest], [])
+        src_dist, src_back = self.local_search(src, src_entrances + [dest] if region[src] == region[dest] else src_entrances)
+        dest_dist, dest_back = self.local_search(dest, dest_entrances)
+        touched = set(src_dist) | set(dest_dist)
+
+        # abstract A*; -1 stands for dest, reached through the entrances of its region
+        costs = {}
+        back = {}
+        queue = []
+        if dest in src_dist:
+            costs[-1] = src_dist[dest]
+            back[-1] = None
+            heappush(queue, (costs[-1], -1))
+        for i in src_entrances:
+            if i in src_dist:
+                costs[i] = src_dist[i]
+                back[i] = None
+                heappush(queue, (costs[i] + self.step(i, dest), i))
+
+        closed = set()
+        while queue:
+            _, node = heappop(queue)
+            if node in closed:
+                continue
+            closed.add(node)
+            if node == -1:
+                break
+            touched.add(node)
+            cost = costs[node]
+            children = list(self.edges.get(node, []))
+            if node in dest_dist:
+                children.append((-1, dest_dist[node]))
+            for child, edge_cost in children:
+                if child in closed:
+                    continue
+                cost_to_child = cost + edge_cost
+                if child not in costs or cost_to_child < costs[child]:
+                    costs[child] = cost_to_child
+                    back[child] = node
+                    heappush(queue, (cost_to_child + (0. if child == -1 else self.step(child, dest)), child))
+
+        if -1 not in closed:
+            return None, list(touched)
+
+        # refine the abstract path into boxes, one region at a time
+        abstract = []
+        node = back[-1]
+        while node is not None:
+            abstract.append(node)
+            node = back[node]
+        abstract.reverse()
+
+        if not abstract:
+            return self.follow(src_back, dest), list(touched)
+
+        corridor = self.follow(src_back, abstract[0])
+        for i, j in zip(abstract, abstract[1:]):
+            if region[i] == region[j]:
+                _, local_back = self.local_search(i, dest=j)
+                touched.update(local_back)
+                corridor.extend(self.follow(local_back, j)[1:])
+            else:
+                corridor.append(j)
+        corridor.extend(reversed(self.follow(dest_back, abstract[-1])[:-1]))
+        return corridor, list(touched)
+
+    def follow(self, back, cell):
+        """ Follows backpointers to the start of a local search. """
+        path = []
+        while cell is not None:
+            path.append(cell)
+            cell = back[cell]
+        path.reverse()
+        return path
+
+
+# how many meshes keep their hierarchy; the least recently used is dropped past that
+HIERARCHY_CACHE_SIZE = 8
+
+_hierarchies = OrderedDict()
+
+
+def hierarchy(mesh):
+    """ Returns the Hierarchy of a mesh, building it on first use.
+
+    Like nm_search.workspace, only the HIERARCHY_CACHE_SIZE most recently used
+    meshes keep theirs, and it is rebuilt when the mesh's 'version' changes.
+
+    """
+    version = mesh.get('version', 0)
+    key = id(mesh)
+    entry = _hierarchies.get(key)
+    if entry is None or entry[0] is not mesh or entry[1] != version:
+        entry = (mesh, version, Hierarchy(mesh))
+        _hierarchies[key] = entry
+    _hierarchies.move_to_end(key)
+    while len(_hierarchies) > HIERARCHY_CACHE_SIZE:
+        _hierarchies.popitem(last=False)
+    return entry[2]
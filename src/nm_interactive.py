@@ -1,8 +1,13 @@
 import sys
-import random
-import pickle
+import base64
+import queue
+import struct
+import threading
 import traceback
 import tkinter
+import zlib
+
+import numpy
 
 import nm_pathfinder
 
@@ -13,8 +18,9 @@ if len(sys.argv) != 4:
 _, MAP_FILENAME, MESH_FILENAME, SUBSAMPLE = sys.argv
 SUBSAMPLE = int(SUBSAMPLE)
 
-with open(MESH_FILENAME, 'rb') as f:
-  mesh = pickle.load(f)
+# how often, in milliseconds, the UI checks for finished work
+POLL_MS = 30
+VISITED_COLOR = (255, 192, 203, 255)
 
 master = tkinter.Tk()
 
@@ -25,65 +31,161 @@ SMALL_WIDTH, SMALL_HEIGHT = small_image.width(), small_image.height()
 
 canvas = tkinter.Canvas(master, width=SMALL_WIDTH, height=SMALL_HEIGHT)
 canvas.pack()
+canvas.create_image((0,0), anchor=tkinter.NW, image=small_image)
+# the visited boxes are drawn into one transparent image over the map
+overlay_item = canvas.create_image((0,0), anchor=tkinter.NW)
+status_item = canvas.create_text((5,5), anchor=tkinter.NW, fill='red', text="Loading mesh...")
+
+# the mesh is loaded and searched on worker threads, which hand their results to
+# the Tk thread through this queue; only the Tk thread touches the canvas
+results = queue.Queue()
+
+mesh = None
+source_point = None
+destination_point = None
+query_id = 0
+overlay_image = None
 
 
 def shrink(values):
     return [v/SUBSAMPLE for v in values]
 
-source_point = None
-destination_point = None
-visited_boxes = []
-path = []
 
+def png_data(rgba):
+    """ Encodes an (height, width, 4) uint8 array as PNG, for PhotoImage(data=...). """
+    height, width, _ = rgba.shape
+    rows = numpy.zeros((height, width * 4 + 1), dtype=numpy.uint8)
+    rows[:, 1:] = rgba.reshape(height, -1)
 
-def redraw():
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
 
-    canvas.delete(tkinter.ALL)
-    canvas.create_image((0,0), anchor=tkinter.NW, image=small_image)
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(rows.tobytes(), 1)) + chunk(b'IEND', b''))
 
-    for box in visited_boxes:
-        x1,x2,y1,y2 = shrink(box)
-        canvas.create_rectangle(y1,x1,y2,x2,outline='pink')
 
+def draw_visited(boxes):
+    """ Replaces the overlay with the outlines of the given boxes. """
+    global overlay_image
+
+    if not boxes:
+        overlay_image = None
+        canvas.itemconfigure(overlay_item, image='')
+        return
+
+    rgba = numpy.zeros((SMALL_HEIGHT, SMALL_WIDTH, 4), dtype=numpy.uint8)
+    for box in boxes:
+        # boxes are (x1, x2, y1, y2) with x the row, like the points
+        x1, x2, y1, y2 = (min(int(v), limit) for v, limit in
+                          zip(shrink(box), (SMALL_HEIGHT - 1, SMALL_HEIGHT - 1, SMALL_WIDTH - 1, SMALL_WIDTH - 1)))
+        rgba[x1, y1:y2 + 1] = VISITED_COLOR
+        rgba[x2, y1:y2 + 1] = VISITED_COLOR
+        rgba[x1:x2 + 1, y1] = VISITED_COLOR
+        rgba[x1:x2 + 1, y2] = VISITED_COLOR
+
+    overlay_image = tkinter.PhotoImage(data=base64.b64encode(png_data(rgba)))
+    canvas.itemconfigure(overlay_item, image=overlay_image)
+
+
+def draw_path(path):
+    canvas.delete('path')
     for i in range(len(path) - 1):
         x1, y1 = shrink(path[i])
         x2, y2 = shrink(path[i + 1])
-        canvas.create_line(y1,x1,y2,x2,width=2.0,fill='red')
+        canvas.create_line(y1,x1,y2,x2,width=2.0,fill='red',tags='path')
+
+
+def draw_markers():
+    canvas.delete('marker')
+    for point in (source_point, destination_point):
+        if point:
+            x,y = shrink(point)
+            canvas.create_oval(y-5,x-5,y+5,x+5,width=2,outline='red',tags='marker')
 
-    if source_point:
-        x,y = shrink(source_point)
-        canvas.create_oval(y-5,x-5,y+5,x+5,width=2,outline='red')
 
-    if destination_point:
-        x,y = shrink(destination_point)
-        canvas.create_oval(y-5,x-5,y+5,x+5,width=2,outline='red')
+def set_status(text):
+    canvas.itemconfigure(status_item, text=text)
+    canvas.tag_raise(status_item)
+
+
+def load_mesh():
+    try:
+        results.put(('mesh', nm_pathfinder.load_mesh(MESH_FILENAME)))
+    except Exception:
+        traceback.print_exc()
+        results.put(('mesh', None))
+
+
+def search(query, source_point, destination_point):
+    try:
+        path, visited_boxes = nm_pathfinder.find_path(source_point, destination_point, mesh)
+    except Exception:
+        traceback.print_exc()
+        path, visited_boxes = None, []
+    results.put(('path', (query, path, list(visited_boxes))))
+
+
+def poll():
+    """ Applies the results the worker threads have posted since the last call. """
+    global mesh, destination_point
+
+    while True:
+        try:
+            kind, value = results.get_nowait()
+        except queue.Empty:
+            break
+
+        if kind == 'mesh':
+            mesh = value
+            set_status("Click a source and a destination." if mesh is not None else "Could not load the mesh.")
+            continue
+
+        query, path, visited_boxes = value
+        if query != query_id:
+            # the points were reset while this query ran
+            continue
+        if path is None:
+            destination_point = None
+            draw_markers()
+            set_status("The search failed.")
+            continue
+        draw_visited(visited_boxes)
+        draw_path(path)
+        set_status("%d boxes visited." % len(visited_boxes) if path else "No path!")
+
+    master.after(POLL_MS, poll)
 
 
 def on_click(event):
 
-    global source_point, destination_point, visited_boxes, path
+    global source_point, destination_point, query_id
+
+    if mesh is None:
+        return
 
     if source_point and destination_point:
         source_point = None
         destination_point = None
-        visited_boxes = []
-        path = []
+        query_id += 1
+        draw_visited([])
+        draw_path([])
+        set_status("Click a source and a destination.")
 
     elif not source_point:
         source_point = event.y*SUBSAMPLE, event.x*SUBSAMPLE
 
     else:
         destination_point = event.y*SUBSAMPLE, event.x*SUBSAMPLE
-        try:
-            path, visited_boxes = nm_pathfinder.find_path(source_point, destination_point, mesh)
-
-        except:
-            destination_point = None
-            traceback.print_exc()
+        query_id += 1
+        set_status("Searching...")
+        threading.Thread(target=search, args=(query_id, source_point, destination_point), daemon=True).start()
 
-    redraw()
+    draw_markers()
 
 canvas.bind('<Button-1>', on_click)
 
-redraw()
+# start loading once the window is up, so it appears without waiting for the mesh
+master.after_idle(lambda: threading.Thread(target=load_mesh, daemon=True).start())
+master.after(POLL_MS, poll)
 master.mainloop()
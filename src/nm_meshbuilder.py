@@ -1,4 +1,8 @@
+import argparse
 import collections
+import multiprocessing
+import multiprocessing.pool
+import os
 import pickle
 import sys
 import random
@@ -7,113 +11,259 @@ from matplotlib.pyplot import imread, imsave
 import numpy
 from numpy import zeros_like
 
+from nm_buildcache import BuildCache, cache_key
+from nm_meshio import (array_filename, build_components, build_labels, build_portals, component_ids, from_dict,
+                       portal_rows, save_array_mesh)
 
-def build_mesh(image, min_feature_size):
-    def scan(box):
+# part of the build cache's key; bump it whenever a change alters the meshes that are built
+BUILDER_VERSION = 2
 
-        x1, x2, y1, y2 = box
-        area = (x2 - x1) * (y2 - y1)
+# image files a directory of maps is searched for
+MAP_EXTENSIONS = ('.png', '.gif')
 
-        if area < min_feature_size or (image[x1:x2, y1:y2] == 255).all() or (image[x1:x2, y1:y2] == 0).all():
 
-            # this box is simple enough to handle in one node
-            if (image[x1:x2, y1:y2] == 255).all():
-                return [box], []
-            else:
-                return [], []
+def summed_area_table(mask):
+    """ Returns the (rows + 1, cols + 1) table of prefix counts of a boolean image. """
+    table = numpy.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=numpy.int32)
+    numpy.cumsum(mask, axis=1, dtype=numpy.int32, out=table[1:, 1:])
+    # adding whole rows is much faster than a cumsum down the columns
+    for x in range(2, table.shape[0]):
+        numpy.add(table[x], table[x - 1], out=table[x])
+    return table
 
+
+def box_count(table, box):
+    """ Counts the pixels set in the box using a table from summed_area_table. """
+    x1, x2, y1, y2 = box
+    return int(table[x2, y2] - table[x1, y2] - table[x2, y1] + table[x1, y1])
+
+
+def split_box(box):
+    """ Splits a box in two on its longest dimension.
+
+    Returns:
+        The two halves, the cut coordinate, and whether the cut is along x.
+
+    """
+    x1, x2, y1, y2 = box
+
+    if x2 - x1 > y2 - y1:
+        cut = int(x1 + (x2 - x1) / 2 + 1)
+        return (x1, cut, y1, y2), (cut, x2, y1, y2), cut, True
+    else:
+        cut = int(y1 + (y2 - y1) / 2 + 1)
+        return (x1, x2, y1, cut), (x1, x2, cut, y2), cut, False
+
+
+def leaf_scan(box, walkable, blocked, min_feature_size):
+    """ Returns the (boxes, edges) of a box simple enough to handle in one node, or None. """
+    x1, x2, y1, y2 = box
+    area = (x2 - x1) * (y2 - y1)
+    all_walkable = box_count(walkable, box) == area
+
+    if area < min_feature_size or all_walkable or box_count(blocked, box) == area:
+        if all_walkable:
+            return [box], []
         else:
+            return [], []
 
-            # recursively split this big box on the longest dimension
-            if x2 - x1 > y2 - y1:
+    return None
 
-                cut = int(x1 + (x2 - x1) / 2 + 1)
-                first_box = (x1, cut, y1, y2)
-                second_box = (cut, x2, y1, y2)
 
-                def rank(b): return (b[2], b[3])
+def scan(box, walkable, blocked, min_feature_size):
+    """ Recursively decomposes a box of the image into walkable boxes.
 
-                def first_touch(b): return b[1] == cut
+    Args:
+        box: The (x1, x2, y1, y2) region to scan.
+        walkable: Summed-area table of the walkable (255) pixels.
+        blocked: Summed-area table of the blocked (0) pixels.
+        min_feature_size: Area below which a box is not split further.
 
-                def second_touch(b): return b[0] == cut
+    Returns:
+        The list of walkable boxes in the region, and the list of (a, b) pairs
+        of adjacent boxes.
 
-            else:
+    """
+    leaf = leaf_scan(box, walkable, blocked, min_feature_size)
+    if leaf is not None:
+        return leaf
 
-                cut = int(y1 + (y2 - y1) / 2 + 1)
-                first_box = (x1, x2, y1, cut)
-                second_box = (x1, x2, cut, y2)
+    # recursively split this big box on the longest dimension
+    first_box, second_box, cut, along_x = split_box(box)
+    first = scan(first_box, walkable, blocked, min_feature_size)
+    second = scan(second_box, walkable, blocked, min_feature_size)
+    return merge_scans(first, second, cut, along_x)
 
-                def rank(b): return (b[0], b[1])
 
-                def first_touch(b): return b[3] == cut
+def merge_scans(first, second, cut, along_x):
+    """ Joins the scans of the two halves of a box along their seam.
 
-                def second_touch(b): return b[2] == cut
+    Boxes on either side of the seam that line up exactly are merged into one,
+    and the others that touch across it become adjacent.
 
-            first_boxes, first_edges = scan(first_box)
-            second_boxes, second_edges = scan(second_box)
+    Args:
+        first: (boxes, edges) of the half before the cut.
+        second: (boxes, edges) of the half after the cut.
+        cut: Coordinate of the seam.
+        along_x: True if the seam is at x == cut, False if it is at y == cut.
 
-            my_boxes = []
-            my_edges = []
+    Returns:
+        The (boxes, edges) of the whole box.
 
-            my_boxes.extend([fb for fb in first_boxes if not first_touch(fb)])
-            my_boxes.extend(
-                [sb for sb in second_boxes if not second_touch(sb)])
+    """
+    first_boxes, first_edges = first
+    second_boxes, second_edges = second
 
-            first_touches = sorted(filter(first_touch, first_boxes), key=rank)
-            second_touches = sorted(
-                filter(second_touch, second_boxes), key=rank)
+    if along_x:
 
-            first_merges = {}
-            second_merges = {}
+        def rank(b): return (b[2], b[3])
 
-            while first_touches and second_touches:
+        def first_touch(b): return b[1] == cut
 
-                f, s = first_touches[0], second_touches[0]
-                rf, rs = rank(f), rank(s)
+        def second_touch(b): return b[0] == cut
 
-                if rf == rs:
+    else:
 
-                    first_touches.pop(0)
-                    second_touches.pop(0)
-                    merged = (f[0], s[1], f[2], s[3])
-                    first_merges[f] = merged
-                    second_merges[s] = merged
-                    my_boxes.append(merged)
+        def rank(b): return (b[0], b[1])
 
-                elif rf[1] < rs[1]:
+        def first_touch(b): return b[3] == cut
 
-                    my_boxes.append(first_touches.pop(0))
-                    if rf[1] >= rs[0]:
-                        my_edges.append((f, s))
+        def second_touch(b): return b[2] == cut
 
-                elif rf[1] > rs[1]:
+    my_boxes = []
+    my_edges = []
 
-                    my_boxes.append(second_touches.pop(0))
-                    if rf[0] <= rs[1]:
-                        my_edges.append((f, s))
+    my_boxes.extend([fb for fb in first_boxes if not first_touch(fb)])
+    my_boxes.extend(
+        [sb for sb in second_boxes if not second_touch(sb)])
+
+    first_touches = sorted(filter(first_touch, first_boxes), key=rank)
+    second_touches = sorted(
+        filter(second_touch, second_boxes), key=rank)
+
+    first_merges = {}
+    second_merges = {}
+    seam_edges = []
+
+    # walk both sides of the seam in order
+    i = j = 0
+    while i < len(first_touches) and j < len(second_touches):
+
+        f, s = first_touches[i], second_touches[j]
+        rf, rs = rank(f), rank(s)
+
+        if rf == rs:
+
+            i += 1
+            j += 1
+            merged = (f[0], s[1], f[2], s[3])
+            first_merges[f] = merged
+            second_merges[s] = merged
+            my_boxes.append(merged)
+
+        elif rf[1] < rs[1]:
+
+            my_boxes.append(f)
+            i += 1
+            if rf[1] >= rs[0]:
+                seam_edges.append((f, s))
+
+        elif rf[1] > rs[1]:
+
+            my_boxes.append(s)
+            j += 1
+            if rf[0] <= rs[1]:
+                seam_edges.append((f, s))
+
+        else:
+
+            my_boxes.append(f)
+            my_boxes.append(s)
+            i += 1
+            j += 1
+            seam_edges.append((f, s))
+
+            # the next box on either side starts where both end, touching the other by a corner
+            if i < len(first_touches) and rank(first_touches[i])[0] == rf[1]:
+                seam_edges.append((first_touches[i], s))
+            if j < len(second_touches) and rank(second_touches[j])[0] == rs[1]:
+                seam_edges.append((f, second_touches[j]))
+
+    my_boxes.extend(first_touches[i:])
+    my_boxes.extend(second_touches[j:])
+
+    # either end of a seam edge may have been merged after the edge was found
+    for a, b in seam_edges:
+        my_edges.append(
+            (first_merges.get(a, a), second_merges.get(b, b)))
+
+    for a, b in first_edges:
+        my_edges.append(
+            (first_merges.get(a, a), first_merges.get(b, b)))
+
+    for a, b in second_edges:
+        my_edges.append(
+            (second_merges.get(a, a), second_merges.get(b, b)))
+
+    return my_boxes, my_edges
 
-                else:
 
-                    my_boxes.append(first_touches.pop(0))
-                    my_boxes.append(second_touches.pop(0))
-                    my_edges.append((f, s))
+# tables shared with the worker processes of a parallel build
+_tile_state = None
 
-            my_boxes.extend(first_touches)
-            my_boxes.extend(second_touches)
 
-            for a, b in first_edges:
-                my_edges.append(
-                    (first_merges.get(a, a), first_merges.get(b, b)))
+def _init_tile_worker(walkable, blocked, min_feature_size):
+    global _tile_state
+    _tile_state = (walkable, blocked, min_feature_size)
 
-            for a, b in second_edges:
-                my_edges.append(
-                    (second_merges.get(a, a), second_merges.get(b, b)))
 
-            return my_boxes, my_edges
+def _scan_tile(box):
+    return scan(box, *_tile_state)
 
-            # end of scan
 
-    boxes, edges = scan((0, image.shape[0], 0, image.shape[1]))
+def parallel_scan(box, walkable, blocked, min_feature_size, workers, tiles_per_worker=4):
+    """ Scans a box like scan, with the tiles at some depth of the recursion run in a process pool.
+
+    The tiles are exactly the boxes the sequential recursion would reach at that
+    depth, and they are stitched back together with merge_scans in the same order,
+    so the result is identical to scan's.
+
+    """
+    depth = max(0, (workers * tiles_per_worker - 1).bit_length())
+
+    with multiprocessing.Pool(workers, _init_tile_worker, (walkable, blocked, min_feature_size)) as pool:
+
+        def plan(box, depth):
+            leaf = leaf_scan(box, walkable, blocked, min_feature_size)
+            if leaf is not None:
+                return leaf
+            if depth == 0:
+                return pool.apply_async(_scan_tile, (box,))
+            first_box, second_box, cut, along_x = split_box(box)
+            return (plan(first_box, depth - 1), plan(second_box, depth - 1), cut, along_x)
+
+        def stitch(node):
+            if isinstance(node, multiprocessing.pool.AsyncResult):
+                return node.get()
+            if len(node) == 2:
+                return node
+            first, second, cut, along_x = node
+            return merge_scans(stitch(first), stitch(second), cut, along_x)
+
+        return stitch(plan(box, depth))
+
+
+def build_mesh(image, min_feature_size, workers=1):
+
+    # pixel counts of any box in O(1), instead of rescanning it at every level
+    walkable = summed_area_table(image == 255)
+    blocked = summed_area_table(image == 0)
+
+    root = (0, image.shape[0], 0, image.shape[1])
+    if workers > 1:
+        boxes, edges = parallel_scan(root, walkable, blocked, min_feature_size, workers)
+    else:
+        boxes, edges = scan(root, walkable, blocked, min_feature_size)
 
     adj = collections.defaultdict(list)
     for a, b in edges:
@@ -121,40 +271,597 @@ def build_mesh(image, min_feature_size):
         adj[b].append(a)
 
     mesh = {'boxes': list(adj.keys()), 'adj': dict(adj)}
+    arrays = from_dict(mesh)
+    mesh['components'] = build_components(arrays)
+    mesh['portals'] = build_portals(arrays)
 
     return mesh
 
 
-if __name__ == '__main__':
-
-    min_feature_size = 16
-    filename = None
-
-    if len(sys.argv) == 2:
-        filename = sys.argv[1]
-    elif len(sys.argv) == 3:
-        filename = sys.argv[1]
-        min_feature_size = int(sys.argv[2])
+# number of boxes or edges copied at a time when streaming arrays to disk
+STREAM_CHUNK = 1 << 20
+
+
+def band_pixels(image, x1, x2):
+    """ Reads rows x1:x2 of a map into memory as a 2D uint8 array of 0..255 values. """
+    band = numpy.asarray(image[x1:x2])
+    if len(band.shape) > 2:
+        band = band[:, :, 0]
+    if band.dtype.kind == 'f':
+        band = (band * 255).astype(dtype=numpy.uint8)
+    return band
+
+
+def shift_scan(result, dx, dy=0):
+    """ Moves the boxes and edges of a scan down by dx rows and right by dy columns. """
+    def shift(b): return (b[0] + dx, b[1] + dx, b[2] + dy, b[3] + dy)
+    boxes, edges = result
+    return [shift(b) for b in boxes], [(shift(a), shift(b)) for a, b in edges]
+
+
+def build_mesh_streaming(image, min_feature_size, prefix, band_rows=1024):
+    """ Builds a mesh band by band, writing it to disk in the array format as it goes.
+
+    Only one band of rows and the boxes touching its lower edge are held in
+    memory, so maps larger than RAM can be processed from a numpy.memmap.
+    Boxes are stitched across band seams with merge_scans, like the halves of a
+    box in scan, but the bands are not the splits the recursion would choose, so
+    the boxes differ from build_mesh's.
+
+    Args:
+        image: An array-like map (e.g. numpy.load(..., mmap_mode='r')) indexed
+            by rows first.
+        min_feature_size: Area below which a box is not split further.
+        prefix: Output path prefix, as for nm_meshio.save_array_mesh.
+        band_rows: Number of rows scanned at a time.
+
+    Returns:
+        The number of boxes in the mesh.
+
+    """
+    rows, cols = image.shape[0], image.shape[1]
+    boxes_tmp = prefix + '.boxes.tmp'
+    edges_tmp = prefix + '.edges.tmp'
+
+    labels_filename = array_filename(prefix, 'labels')
+    labels = numpy.lib.format.open_memmap(labels_filename, 'w+', numpy.int32, (rows, cols))
+    header_size = labels.offset
+    del labels
+    # fill with -1 through plain writes, so the whole raster is never mapped at once
+    with open(labels_filename, 'r+b') as f:
+        f.seek(header_size)
+        for x in range(0, rows, band_rows):
+            f.write(numpy.full((min(band_rows, rows - x), cols), -1, dtype=numpy.int32).tobytes())
+
+    # boxes touching the last seam, and edges that still involve one of them
+    open_result = ([], [])
+    ids = {}
+    count = 0
+
+    with open(boxes_tmp, 'wb') as boxes_file, open(edges_tmp, 'wb') as edges_file:
+
+        for x1 in range(0, rows, band_rows):
+            x2 = min(x1 + band_rows, rows)
+            band = band_pixels(image, x1, x2)
+            walkable = summed_area_table(band == 255)
+            blocked = summed_area_table(band == 0)
+            result = shift_scan(scan((0, x2 - x1, 0, cols), walkable, blocked, min_feature_size), x1)
+            del band, walkable, blocked
+
+            boxes, edges = merge_scans(open_result, result, x1, True)
+
+            # only boxes on the next seam can still be merged or gain neighbors
+            connected = set(a for a, b in edges) | set(b for a, b in edges)
+            open_boxes = []
+            finished = []
+            for box in boxes:
+                if box[1] == x2 and x2 < rows:
+                    open_boxes.append(box)
+                elif box in connected:
+                    # boxes without neighbors are left out, as in build_mesh
+                    ids[box] = count + len(finished)
+                    finished.append(box)
+            fill_labels(labels_filename, header_size, cols, finished, count, band_rows)
+            count += len(finished)
+            if finished:
+                boxes_file.write(numpy.array(finished, dtype=numpy.int32).tobytes())
+
+            pending = []
+            done = []
+            for a, b in edges:
+                if a in ids and b in ids:
+                    done.append((ids[a], ids[b]))
+                else:
+                    pending.append((a, b))
+            if done:
+                edges_file.write(numpy.array(done, dtype=numpy.int32).tobytes())
+
+            open_result = (open_boxes, pending)
+            ids = {box: ids[box] for edge in pending for box in edge if box in ids}
+
+    out = numpy.lib.format.open_memmap(array_filename(prefix, 'boxes'), 'w+', numpy.int32, (count, 4))
+    if count:
+        boxes = numpy.memmap(boxes_tmp, dtype=numpy.int32, mode='r').reshape(-1, 4)
+        for i in range(0, count, STREAM_CHUNK):
+            out[i:i + STREAM_CHUNK] = boxes[i:i + STREAM_CHUNK]
+        del boxes
+    out.flush()
+    del out
+    os.remove(boxes_tmp)
+
+    write_csr(edges_tmp, count, prefix)
+    if os.path.getsize(edges_tmp):
+        edges = numpy.memmap(edges_tmp, dtype=numpy.int32, mode='r').reshape(-1, 2)
     else:
-        print("usage: %s map_filename min_feature_size" % sys.argv[0])
-        sys.exit(-1)
-
+        edges = numpy.zeros((0, 2), numpy.int32)
+    numpy.save(array_filename(prefix, 'components'), component_ids(count, edges, STREAM_CHUNK))
+    del edges
+    os.remove(edges_tmp)
+
+    return count
+
+
+def fill_labels(filename, header_size, cols, boxes, first_id, band_rows):
+    """ Labels consecutive boxes of a label raster file, mapping at most band_rows rows of it at a time. """
+    if not boxes:
+        return
+    top = min(box[0] for box in boxes)
+    bottom = max(box[1] for box in boxes)
+    for x in range(top, bottom, band_rows):
+        rows = min(band_rows, bottom - x)
+        labels = numpy.memmap(filename, dtype=numpy.int32, mode='r+',
+                              offset=header_size + 4 * x * cols, shape=(rows, cols))
+        for i, (x1, x2, y1, y2) in enumerate(boxes):
+            if x1 < x + rows and x2 > x:
+                labels[max(x1 - x, 0):x2 - x, y1:y2] = first_id + i
+        labels.flush()
+        del labels
+
+
+def write_csr(edges_filename, count, prefix):
+    """ Turns a raw file of int32 (a, b) edges into the CSR offsets, neighbors and portals arrays of a mesh.
+
+    The boxes array must already be saved under prefix.
+
+    """
+    if os.path.getsize(edges_filename):
+        edges = numpy.memmap(edges_filename, dtype=numpy.int32, mode='r').reshape(-1, 2)
+    else:
+        edges = numpy.zeros((0, 2), numpy.int32)
+
+    degree = numpy.zeros(count, dtype=numpy.int64)
+    for i in range(0, len(edges), STREAM_CHUNK):
+        chunk = numpy.asarray(edges[i:i + STREAM_CHUNK])
+        degree += numpy.bincount(chunk.ravel(), minlength=count)
+
+    offsets = numpy.lib.format.open_memmap(array_filename(prefix, 'offsets'), 'w+', numpy.int64, (count + 1,))
+    offsets[0] = 0
+    numpy.cumsum(degree, out=offsets[1:])
+    cursor = numpy.array(offsets[:-1])
+    offsets.flush()
+    del degree, offsets
+
+    boxes = numpy.load(array_filename(prefix, 'boxes'), mmap_mode='r')
+    neighbors = numpy.lib.format.open_memmap(array_filename(prefix, 'neighbors'), 'w+', numpy.int32, (2 * len(edges),))
+    portals = numpy.lib.format.open_memmap(array_filename(prefix, 'portals'), 'w+', numpy.int32, (2 * len(edges), 4))
+    for i in range(0, len(edges), STREAM_CHUNK):
+        chunk = numpy.asarray(edges[i:i + STREAM_CHUNK])
+        for src, dst in ((chunk[:, 0], chunk[:, 1]), (chunk[:, 1], chunk[:, 0])):
+            order = numpy.argsort(src, kind='stable')
+            src = src[order]
+            dst = dst[order]
+            # position of each edge among the edges of the same box in this chunk
+            rank = numpy.arange(len(src)) - numpy.searchsorted(src, src)
+            neighbors[cursor[src] + rank] = dst
+            portals[cursor[src] + rank] = portal_rows(boxes, src, dst)
+            cursor += numpy.bincount(src, minlength=count)
+    neighbors.flush()
+    portals.flush()
+    del neighbors, portals, boxes, edges
+
+
+def subtract_box(box, cut):
+    """ Returns the up to four boxes covering the part of box outside of cut. """
+    x1, x2, y1, y2 = box
+    cx1, cx2, cy1, cy2 = cut
+    pieces = []
+    if x1 < cx1:
+        pieces.append((x1, cx1, y1, y2))
+    if cx2 < x2:
+        pieces.append((cx2, x2, y1, y2))
+    mx1, mx2 = max(x1, cx1), min(x2, cx2)
+    if y1 < cy1:
+        pieces.append((mx1, mx2, y1, cy1))
+    if cy2 < y2:
+        pieces.append((mx1, mx2, cy2, y2))
+    return pieces
+
+
+def touching_ids(labels, box):
+    """ Returns the labels found in the ring of pixels around a box, corners included. """
+    x1, x2, y1, y2 = box
+    rx1, rx2 = max(x1 - 1, 0), min(x2 + 1, labels.shape[0])
+    ry1, ry2 = max(y1 - 1, 0), min(y2 + 1, labels.shape[1])
+    ring = [labels[rx1:rx2, ry1:ry1 + 1] if y1 > 0 else labels[0:0, 0:0],
+            labels[rx1:rx2, y2:ry2],
+            labels[rx1:rx1 + 1, y1:y2] if x1 > 0 else labels[0:0, 0:0],
+            labels[x2:rx2, y1:y2]]
+    ids = numpy.unique(numpy.concatenate([r.ravel() for r in ring]))
+    return ids[ids >= 0].tolist()
+
+
+def overlaps(a, b):
+    return a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]
+
+
+def is_leaf(image, box, min_feature_size):
+    """ Tells whether scan would stop at this box, reading as few pixels as it can. """
+    x1, x2, y1, y2 = box
+    if (x2 - x1) * (y2 - y1) < min_feature_size:
+        return True
+    value = image[x1, y1]
+    if value != 0 and value != 255:
+        return False
+    # a few samples are usually enough to tell a big box is mixed
+    for x, y in ((x2 - 1, y2 - 1), (x1, y2 - 1), (x2 - 1, y1), ((x1 + x2) // 2, (y1 + y2) // 2)):
+        if image[x, y] != value:
+            return False
+    return bool((image[x1:x2, y1:y2] == value).all())
+
+
+def dirty_nodes(image, rect, min_feature_size):
+    """ Returns the boxes of build_mesh's recursion that must be rescanned after rect changed.
+
+    These are the largest boxes of the recursion that overlap rect and either lie
+    inside it or are leaves for the updated image. Everything outside of them
+    scans exactly as it did before the edit.
+
+    """
+    nodes = []
+    stack = [(0, image.shape[0], 0, image.shape[1])]
+    while stack:
+        node = stack.pop()
+        if not overlaps(node, rect):
+            continue
+        x1, x2, y1, y2 = node
+        if (rect[0] <= x1 and x2 <= rect[1] and rect[2] <= y1 and y2 <= rect[3]) or is_leaf(image, node, min_feature_size):
+            nodes.append(node)
+        else:
+            first_box, second_box, _, _ = split_box(node)
+            stack.append(first_box)
+            stack.append(second_box)
+    return nodes
+
+
+def leaf_at(image, point, min_feature_size):
+    """ Returns the leaf box of build_mesh's recursion that contains a pixel. """
+    node = (0, image.shape[0], 0, image.shape[1])
+    while not is_leaf(image, node, min_feature_size):
+        first_box, second_box, _, _ = split_box(node)
+        node = first_box if overlaps(first_box, (point[0], point[0] + 1, point[1], point[1] + 1)) else second_box
+    return node
+
+
+def update_components(mesh, components, affected):
+    """ Renumbers the components of the boxes an edit may have merged or split.
+
+    Args:
+        mesh: The edited mesh, with its 'labels' raster up to date.
+        components: The component ids of its boxes, -1 for new boxes.
+        affected: The ids of the components the removed boxes belonged to.
+
+    Returns:
+        The updated components array. The cost is linear in the size of the
+        affected components rather than in the size of the mesh.
+
+    """
+    boxes = mesh['boxes']
+    adj = mesh['adj']
+    labels = mesh['labels']
+    next_id = int(components.max(initial=-1)) + 1
+
+    # new boxes may join components the edit didn't cut into
+    added = numpy.nonzero(components < 0)[0].tolist()
+    joined = [components[int(labels[other[0], other[2]])] for i in added for other in adj[boxes[i]]]
+    affected = numpy.union1d(affected, numpy.array(joined, dtype=components.dtype))
+    pending = (components < 0) | numpy.isin(components, affected)
+    for start in numpy.nonzero(pending)[0].tolist():
+        if not pending[start]:
+            continue
+        pending[start] = False
+        components[start] = next_id
+        stack = [start]
+        while stack:
+            for other in adj[boxes[stack.pop()]]:
+                j = int(labels[other[0], other[2]])
+                if pending[j]:
+                    pending[j] = False
+                    components[j] = next_id
+                    stack.append(j)
+        next_id += 1
+    return components
+
+
+def isolated_rectangle(adj, image, box):
+    """ Returns the boxes connected to box if together they tile a rectangle, else [].
+
+    The seams of build_mesh's recursion merge such boxes into the one box of the
+    rectangle, which it then drops for having no neighbors. The walkable pixels
+    of the rectangle are checked as it grows, so that the search stops at the
+    first obstacle instead of walking the whole connected area.
+
+    """
+    group = {box}
+    stack = [box]
+    area = 0
+    bounds = box
+    while stack:
+        b = stack.pop()
+        area += (b[1] - b[0]) * (b[3] - b[2])
+        grown = (min(bounds[0], b[0]), max(bounds[1], b[1]), min(bounds[2], b[2]), max(bounds[3], b[3]))
+        if grown != bounds:
+            for x1, x2, y1, y2 in subtract_box(grown, bounds):
+                if not (image[x1:x2, y1:y2] == 255).all():
+                    return []
+            bounds = grown
+        for other in adj[b]:
+            if other not in group:
+                group.add(other)
+                stack.append(other)
+    if area != (bounds[1] - bounds[0]) * (bounds[3] - bounds[2]):
+        return []
+    return list(group)
+
+
+def rebuild_region(mesh, image, rect, min_feature_size):
+    """ Updates a mesh in place after the pixels inside rect have changed.
+
+    Only the parts of build_mesh's recursion that overlap rect are rescanned;
+    the boxes overlapping them are cut back to their parts outside, and
+    adjacency is recomputed only around the new boxes. The walkable area and
+    its connectivity then match a full rebuild of the updated image, although
+    the boxes may be split differently. The cost depends on the size of the
+    edit and the boxes it touches rather than on the size of the map.
+
+    Args:
+        mesh: A dict mesh built by build_mesh, with a writable 'labels' raster
+            (one is built if missing).
+        image: The updated map.
+        rect: The (x1, x2, y1, y2) region that changed.
+        min_feature_size: The value the mesh was built with.
+
+    Returns:
+        The list of boxes that were added to the mesh.
+
+    """
+    labels = mesh.get('labels')
+    if labels is None or not labels.flags.writeable:
+        labels = build_labels(mesh, image.shape) if labels is None else numpy.array(labels)
+        mesh['labels'] = labels
+    boxes = mesh['boxes']
+    adj = mesh['adj']
+
+    x1, x2, y1, y2 = rect
+    rect = (max(x1, 0), min(x2, image.shape[0]), max(y1, 0), min(y2, image.shape[1]))
+    if rect[0] >= rect[1] or rect[2] >= rect[3]:
+        return []
+    nodes = dirty_nodes(image, rect, min_feature_size)
+
+    # boxes overlapping the rescanned nodes are replaced by their parts outside of them
+    cut_ids = set()
+    for x1, x2, y1, y2 in nodes:
+        region = labels[x1:x2, y1:y2]
+        cut_ids.update(numpy.unique(region[region >= 0]).tolist())
+    cut_ids = sorted(cut_ids)
+
+    components = mesh.get('components')
+    if components is not None:
+        components = numpy.array(components)
+        affected = numpy.unique(components[cut_ids])
+
+    new_boxes = []
+    touched = set()
+    for i in cut_ids:
+        box = boxes[i]
+        pieces = [box]
+        for node in nodes:
+            pieces = [p for piece in pieces for p in (subtract_box(piece, node) if overlaps(piece, node) else [piece])]
+        new_boxes.extend(pieces)
+        for other in adj.pop(box, []):
+            if other in adj:
+                adj[other] = [b for b in adj[other] if b != box]
+                touched.add(other)
+        labels[box[0]:box[1], box[2]:box[3]] = -1
+
+    for node in nodes:
+        x1, x2, y1, y2 = node
+        band = image[x1:x2, y1:y2]
+        walkable = summed_area_table(band == 255)
+        blocked = summed_area_table(band == 0)
+        scanned, _ = shift_scan(scan((0, x2 - x1, 0, y2 - y1), walkable, blocked, min_feature_size), x1, y1)
+        new_boxes.extend(scanned)
+
+    # reuse the ids of the removed boxes before growing the list
+    free = cut_ids
+
+    def add_box(box):
+        if free:
+            i = free.pop(0)
+            boxes[i] = box
+        else:
+            i = len(boxes)
+            boxes.append(box)
+        labels[box[0]:box[1], box[2]:box[3]] = i
+
+    for box in new_boxes:
+        add_box(box)
+
+    # walkable leaves next to the nodes may have been dropped for having no
+    # neighbors, along with the leaves build_mesh had merged them with
+    frontier = list(nodes)
+    while frontier:
+        x1, x2, y1, y2 = frontier.pop()
+        rx1, rx2 = max(x1 - 1, 0), min(x2 + 1, image.shape[0])
+        ry1, ry2 = max(y1 - 1, 0), min(y2 + 1, image.shape[1])
+        ring = numpy.zeros((rx2 - rx1, ry2 - ry1), dtype=bool)
+        ring[[0, -1], :] = True
+        ring[:, [0, -1]] = True
+        candidates = ring & (labels[rx1:rx2, ry1:ry2] < 0) & (image[rx1:rx2, ry1:ry2] == 255)
+        for x, y in zip(*numpy.nonzero(candidates)):
+            point = (rx1 + int(x), ry1 + int(y))
+            if labels[point] >= 0 or any(overlaps(node, (point[0], point[0] + 1, point[1], point[1] + 1)) for node in nodes):
+                continue
+            leaf = leaf_at(image, point, min_feature_size)
+            if (image[leaf[0]:leaf[1], leaf[2]:leaf[3]] == 255).all():
+                new_boxes.append(leaf)
+                add_box(leaf)
+                frontier.append(leaf)
+
+    if components is not None:
+        components = numpy.concatenate([components, numpy.full(len(boxes) - len(components), -1, numpy.int32)])
+        components[[labels[box[0], box[2]] for box in new_boxes]] = -1
+
+    for box in new_boxes:
+        adj[box] = []
+    for box in new_boxes:
+        for j in touching_ids(labels, box):
+            other = boxes[j]
+            if other not in adj[box]:
+                adj[box].append(other)
+            if box not in adj[other]:
+                adj[other].append(box)
+
+    # boxes left without neighbors are dropped, as build_mesh does; boxes that
+    # only touch each other are dropped too if build_mesh would merge them into one
+    for box in list(touched) + new_boxes:
+        if box in adj:
+            for dropped in isolated_rectangle(adj, image, box):
+                del adj[dropped]
+                free.append(int(labels[dropped[0], dropped[2]]))
+                labels[dropped[0]:dropped[1], dropped[2]:dropped[3]] = -1
+
+    # fill the remaining holes in the list with boxes from its end
+    for i in sorted(free, reverse=True):
+        last = len(boxes) - 1
+        if i != last:
+            moved = boxes[last]
+            boxes[i] = moved
+            labels[moved[0]:moved[1], moved[2]:moved[3]] = i
+            if components is not None:
+                components[i] = components[last]
+        boxes.pop()
+
+    if components is not None:
+        mesh['components'] = update_components(mesh, components[:len(boxes)], affected)
+
+    # portals are aligned with the adjacency, which changed; searches rebuild them when missing
+    mesh.pop('portals', None)
+    # landmark distances are indexed by the old box ids; rerun nm_landmarks to restore them
+    mesh.pop('landmarks', None)
+    mesh.pop('landmark_dist', None)
+    mesh['version'] = mesh.get('version', 0) + 1
+    return [box for box in new_boxes if box in adj]
+
+
+def build_map(filename, min_feature_size, fmt='pickle', workers=1, cache=None):
+    """ Builds the mesh of a map image and writes it next to the image, with its .mesh.png atlas.
+
+    Args:
+        filename: The map image.
+        min_feature_size: Passed on to build_mesh.
+        fmt: 'pickle' for a .mesh.pickle and its label raster, or 'arrays' for .mesh.*.npy arrays.
+        workers: Passed on to build_mesh.
+        cache: An optional nm_buildcache.BuildCache; a build it holds is copied
+            instead of being built and rendered again.
+
+    Returns:
+        The number of boxes of the mesh, or None if it came from the cache.
+
+    """
     img = (imread(filename) * 255).astype(dtype=numpy.uint8)
     if len(img.shape) > 2:
         img = img[:, :, 0]
 
-    mesh = build_mesh(img, min_feature_size)
+    if cache is not None:
+        key = cache_key(img, min_feature_size, fmt, BUILDER_VERSION)
+        if cache.restore(key, filename):
+            return None
 
-    print(type(mesh))
-    print(mesh.keys())
+    mesh = build_mesh(img, min_feature_size, workers)
 
-    with open(filename + '.mesh.pickle', 'wb') as f:
-        pickle.dump(mesh, f, protocol=pickle.HIGHEST_PROTOCOL)
+    labels = build_labels(mesh, img.shape)
+
+    if fmt == 'arrays':
+        mesh['labels'] = labels
+        saved = save_array_mesh(mesh, filename + '.mesh')
+        suffixes = ['.mesh.%s.npy' % name for name in saved.arrays]
+    else:
+        with open(filename + '.mesh.pickle', 'wb') as f:
+            pickle.dump(mesh, f, protocol=pickle.HIGHEST_PROTOCOL)
+        numpy.save(filename + '.mesh.labels.npy', labels)
+        suffixes = ['.mesh.pickle', '.mesh.labels.npy']
 
     atlas = zeros_like(img)
     for x1, x2, y1, y2 in mesh['boxes']:
         atlas[x1:x2, y1:y2] = random.randint(64, 255)
 
     imsave(filename + '.mesh.png', atlas)
+    suffixes.append('.mesh.png')
+
+    if cache is not None:
+        cache.store(key, filename, suffixes)
+    return len(mesh['boxes'])
+
+
+def map_files(directory):
+    """ Returns the map images in a directory, leaving out the .mesh.png atlases. """
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                  if f.endswith(MAP_EXTENSIONS) and not f.endswith('.mesh.png'))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Builds a navmesh from a map image.")
+    parser.add_argument('map_filename', help="a map image, or a directory of them to build in one run")
+    parser.add_argument('min_feature_size', nargs='?', type=int, default=16)
+    parser.add_argument('--format', choices=('pickle', 'arrays'), default='pickle',
+                        help="write a .mesh.pickle, or .mesh.*.npy arrays that load memory-mapped")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes to scan tiles of the image with")
+    parser.add_argument('--band-rows', type=int, default=None,
+                        help="build the mesh this many rows at a time, writing arrays as it goes "
+                             "(for maps larger than memory; .npy maps are read memory-mapped)")
+    parser.add_argument('--cache', metavar='DIR',
+                        help="reuse the outputs of earlier builds of the same pixels and settings stored in DIR")
+    parser.add_argument('--cache-max-mb', type=float, default=None,
+                        help="after building, evict the least recently used cache entries above this size")
+    parser.add_argument('--cache-max-days', type=float, default=None,
+                        help="after building, evict cache entries unused for this many days")
+    args = parser.parse_args()
+
+    filename = args.map_filename
+    min_feature_size = args.min_feature_size
+
+    if args.band_rows:
+        if filename.endswith('.npy'):
+            image = numpy.load(filename, mmap_mode='r')
+        else:
+            image = imread(filename)
+        count = build_mesh_streaming(image, min_feature_size, filename + '.mesh', args.band_rows)
+        print("Built a mesh with %d boxes." % count)
+        sys.exit(0)
+
+    cache = BuildCache(args.cache) if args.cache else None
+    filenames = map_files(filename) if os.path.isdir(filename) else [filename]
+    for filename in filenames:
+        count = build_map(filename, min_feature_size, args.format, args.workers, cache)
+        if count is None:
+            print("Reused the cached mesh of %s." % filename)
+        else:
+            print("Built a mesh with %d boxes for %s." % (count, filename))
 
-    print("Built a mesh with %d boxes." % len(mesh['boxes']))
+    if cache is not None and (args.cache_max_mb is not None or args.cache_max_days is not None):
+        removed = cache.evict(None if args.cache_max_mb is None else int(args.cache_max_mb * 2 ** 20),
+                              None if args.cache_max_days is None else args.cache_max_days * 86400)
+        if removed:
+            print("Evicted %d cache entries." % removed)
@@ -0,0 +1,402 @@
+import os
+import pickle
+import sys
+
+import numpy
+
+# arrays that make up a mesh in the array format, stored as <prefix>.<name>.npy
+REQUIRED_ARRAYS = ('boxes', 'offsets', 'neighbors')
+OPTIONAL_ARRAYS = ('labels', 'components', 'landmarks', 'landmark_dist', 'portals')
+
+
+class ArrayMesh:
+    """ A mesh stored as flat arrays instead of tuples, dicts and lists.
+
+    Box i is boxes[i] = (x1, x2, y1, y2), and its neighbors are the box ids
+    neighbors[offsets[i]:offsets[i + 1]] (CSR adjacency). The optional portals
+    array is aligned with neighbors: portals[k] = (x1, x2, y1, y2) is the border
+    box i shares with neighbors[k], the range detail points are clamped into.
+
+    It can be indexed like the dict meshes built by nm_meshbuilder:
+    mesh['boxes'] is a sequence of box tuples and mesh['adj'][box] is a list of
+    the neighboring box tuples, so the searches in nm_pathfinder accept it as is.
+    Any other key (e.g. 'labels') returns the array stored under that name.
+
+    """
+
+    def __init__(self, arrays):
+        for name in REQUIRED_ARRAYS:
+            if name not in arrays:
+                raise ValueError("mesh is missing the '%s' array" % name)
+        self.arrays = dict(arrays)
+        self.boxes = self.arrays['boxes']
+        self.offsets = self.arrays['offsets']
+        self.neighbors = self.arrays['neighbors']
+        self._ids = None
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __getitem__(self, key):
+        if key == 'boxes':
+            return BoxList(self)
+        if key == 'adj':
+            return AdjView(self)
+        return self.arrays[key]
+
+    def __contains__(self, key):
+        return key in ('boxes', 'adj') or key in self.arrays
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def box(self, i):
+        """ Returns box i as a tuple of python ints. """
+        return tuple(self.boxes[i].tolist())
+
+    def box_id(self, box):
+        """ Returns the id of the given box tuple, raising KeyError if it is not in the mesh. """
+        labels = self.arrays.get('labels')
+        if labels is not None:
+            x1, x2, y1, y2 = box
+            if 0 <= x1 < labels.shape[0] and 0 <= y1 < labels.shape[1]:
+                i = int(labels[x1, y1])
+                if i >= 0 and self.box(i) == tuple(box):
+                    return i
+
+        # meshes can hold boxes overlapped by others, which the raster can't resolve
+        if self._ids is None:
+            self._ids = {self.box(i): i for i in range(len(self.boxes))}
+        return self._ids[tuple(box)]
+
+    def neighbor_ids(self, i):
+        """ Returns the ids of the boxes adjacent to box i. """
+        return self.neighbors[self.offsets[i]:self.offsets[i + 1]]
+
+
+class BoxList:
+    """ Read-only sequence view of an ArrayMesh's boxes as tuples. """
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+
+    def __len__(self):
+        return len(self.mesh.boxes)
+
+    def __getitem__(self, i):
+        return self.mesh.box(i)
+
+    def __iter__(self):
+        for box in self.mesh.boxes.tolist():
+            yield tuple(box)
+
+
+class AdjView:
+    """ Read-only mapping view of an ArrayMesh's adjacency keyed by box tuples. """
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+
+    def __len__(self):
+        return len(self.mesh.boxes)
+
+    def __getitem__(self, box):
+        mesh = self.mesh
+        return [mesh.box(j) for j in mesh.neighbor_ids(mesh.box_id(box)).tolist()]
+
+    def __contains__(self, box):
+        try:
+            self.mesh.box_id(box)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(BoxList(self.mesh))
+
+    def keys(self):
+        return BoxList(self.mesh)
+
+    def items(self):
+        for i, box in enumerate(BoxList(self.mesh)):
+            yield box, self[box]
+
+
+def from_dict(mesh):
+    """ Converts a dict mesh built by nm_meshbuilder into an ArrayMesh.
+
+    Args:
+        mesh: A mesh dict with 'boxes' and 'adj' keys. Extra array-valued keys
+            (such as 'labels') are carried over.
+
+    Returns:
+        An in-memory ArrayMesh whose box ids are the indices into mesh['boxes'].
+        Its boxes are int32, or float64 for legacy meshes whose boxes have
+        fractional coordinates, so that they still match the keys of mesh['adj'].
+
+    """
+    if isinstance(mesh, ArrayMesh):
+        return mesh
+
+    box_list = mesh['boxes']
+    ids = {box: i for i, box in enumerate(box_list)}
+
+    boxes = numpy.array(box_list, dtype=numpy.float64).reshape(-1, 4)
+    if is_integral(boxes):
+        boxes = boxes.astype(numpy.int32)
+    offsets = numpy.zeros(len(box_list) + 1, dtype=numpy.int64)
+    neighbors = []
+    for i, box in enumerate(box_list):
+        adj = mesh['adj'].get(box, [])
+        neighbors.extend(ids[b] for b in adj)
+        offsets[i + 1] = len(neighbors)
+
+    arrays = {name: mesh[name] for name in OPTIONAL_ARRAYS if mesh.get(name) is not None}
+    arrays['boxes'] = boxes
+    arrays['offsets'] = offsets
+    arrays['neighbors'] = numpy.array(neighbors, dtype=numpy.int32)
+    return ArrayMesh(arrays)
+
+
+def is_integral(boxes):
+    """ Tells whether an array of boxes has integer coordinates only, as label rasters need. """
+    boxes = numpy.asarray(boxes)
+    return boxes.dtype.kind in 'iu' or bool((boxes == numpy.floor(boxes)).all())
+
+
+def to_dict(mesh):
+    """ Converts an ArrayMesh back into a dict mesh of tuples and lists. """
+    box_list = list(BoxList(mesh))
+    adj = {}
+    for i, box in enumerate(box_list):
+        adj[box] = [box_list[j] for j in mesh.neighbor_ids(i).tolist()]
+    result = {'boxes': box_list, 'adj': adj}
+    for name in OPTIONAL_ARRAYS:
+        if name in mesh.arrays:
+            result[name] = mesh.arrays[name]
+    return result
+
+
+def build_labels(mesh, shape):
+    """ Rasterizes the mesh into a per-pixel box-index image.
+
+    Args:
+        mesh: A mesh as returned by nm_meshbuilder.build_mesh, or an ArrayMesh.
+        shape: The (rows, cols) shape of the source image.
+
+    Returns:
+        An int32 array of the given shape where each pixel holds the index of the
+        box in mesh['boxes'] that covers it, or -1 if no box does.
+
+    """
+    labels = numpy.full(shape, -1, dtype=numpy.int32)
+    for i, (x1, x2, y1, y2) in enumerate(mesh['boxes']):
+        labels[x1:x2, y1:y2] = i
+    return labels
+
+
+def component_ids(count, edges, chunk_size=1 << 20):
+    """ Labels the connected components of a graph given as a list of edges.
+
+    Each round hooks the larger of the two roots of every edge onto the smaller
+    one, then compresses the parent pointers, so it works on whole arrays at a
+    time and only reads the edges chunk_size at a time (they can be a memmap).
+
+    Args:
+        count: The number of nodes.
+        edges: An (E, 2) integer array of node ids.
+
+    Returns:
+        An int32 array with the component id of each node, numbered from 0.
+
+    """
+    parent = numpy.arange(count, dtype=numpy.int32)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(0, len(edges), chunk_size):
+            chunk = numpy.asarray(edges[i:i + chunk_size])
+            a = parent[chunk[:, 0]]
+            b = parent[chunk[:, 1]]
+            hooked = a != b
+            if hooked.any():
+                numpy.minimum.at(parent, numpy.maximum(a, b)[hooked], numpy.minimum(a, b)[hooked])
+                changed = True
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+    return numpy.unique(parent, return_inverse=True)[1].astype(numpy.int32).reshape(-1)
+
+
+def build_components(mesh):
+    """ Returns the connected component id of every box of a mesh (dict or ArrayMesh).
+
+    Two boxes have the same id exactly when a path exists between them.
+
+    """
+    mesh = from_dict(mesh)
+    degree = numpy.diff(numpy.asarray(mesh.offsets))
+    sources = numpy.repeat(numpy.arange(len(mesh), dtype=numpy.int32), degree)
+    return component_ids(len(mesh), numpy.stack([sources, numpy.asarray(mesh.neighbors)], axis=1))
+
+
+def portal_rows(boxes, sources, targets):
+    """ Returns the (len(sources), 4) array of the borders shared by boxes[sources] and boxes[targets],
+    of the same type as the boxes. """
+    a = numpy.asarray(boxes)[sources]
+    b = numpy.asarray(boxes)[targets]
+    return numpy.stack([numpy.maximum(a[:, 0], b[:, 0]), numpy.minimum(a[:, 1], b[:, 1]),
+                        numpy.maximum(a[:, 2], b[:, 2]), numpy.minimum(a[:, 3], b[:, 3])], axis=1)
+
+
+def build_portals(mesh):
+    """ Returns the portals array of a mesh (dict or ArrayMesh), aligned with its CSR neighbors. """
+    mesh = from_dict(mesh)
+    degree = numpy.diff(numpy.asarray(mesh.offsets))
+    sources = numpy.repeat(numpy.arange(len(mesh), dtype=numpy.int32), degree)
+    return portal_rows(mesh.boxes, sources, numpy.asarray(mesh.neighbors))
+
+
+def array_filename(prefix, name):
+    return '%s.%s.npy' % (prefix, name)
+
+
+def save_arrays(prefix, arrays):
+    """ Writes each array to <prefix>.<name>.npy. """
+    for name, array in arrays.items():
+        numpy.save(array_filename(prefix, name), numpy.asarray(array))
+
+
+def save_array_mesh(mesh, prefix):
+    """ Writes a mesh (dict or ArrayMesh) in the array format.
+
+    Args:
+        mesh: The mesh to save.
+        prefix: Path prefix of the output files, e.g. 'map.png.mesh', which
+            produces map.png.mesh.boxes.npy, map.png.mesh.offsets.npy, ...
+
+    Returns:
+        The saved ArrayMesh.
+
+    """
+    mesh = from_dict(mesh)
+    save_arrays(prefix, mesh.arrays)
+    return mesh
+
+
+def load_array_mesh(prefix, mmap_mode='r'):
+    """ Loads a mesh saved by save_array_mesh without reading the arrays into memory.
+
+    Args:
+        prefix: Path prefix the mesh was saved under.
+        mmap_mode: Passed on to numpy.load; the default maps the files read-only.
+
+    Returns:
+        An ArrayMesh backed by numpy.memmap arrays.
+
+    """
+    arrays = {}
+    for name in REQUIRED_ARRAYS + OPTIONAL_ARRAYS:
+        filename = array_filename(prefix, name)
+        if name in REQUIRED_ARRAYS or os.path.exists(filename):
+            arrays[name] = numpy.load(filename, mmap_mode=mmap_mode)
+    return ArrayMesh(arrays)
+
+
+def load_mesh(filename):
+    """ Loads a mesh in either on-disk format.
+
+    Args:
+        filename: Either a .mesh.pickle file or the prefix of an array mesh
+            (e.g. 'map.png.mesh').
+
+    Returns:
+        A dict mesh for pickles, with its optional arrays (such as the label
+        raster) memory-mapped from the files next to it, or an ArrayMesh.
+
+    """
+    if not filename.endswith('.pickle'):
+        return load_array_mesh(filename)
+
+    with open(filename, 'rb') as f:
+        mesh = pickle.load(f)
+
+    prefix = filename[:-len('.pickle')]
+    for name in OPTIONAL_ARRAYS:
+        if os.path.exists(array_filename(prefix, name)):
+            mesh[name] = numpy.load(array_filename(prefix, name), mmap_mode='r')
+
+    return mesh
+
+
+def convert_pickle(filename):
+    """ Converts a legacy .mesh.pickle into the array format next to it.
+
+    Args:
+        filename: Path of the .mesh.pickle file.
+
+    Returns:
+        The converted ArrayMesh, memory-mapped from the new files.
+
+    """
+    mesh = load_mesh(filename)
+    prefix = filename[:-len('.pickle')]
+
+    # arrays loaded from next to the pickle are already where they belong
+    existing = [name for name in OPTIONAL_ARRAYS if os.path.exists(array_filename(prefix, name))]
+
+    # boxes with fractional coordinates (from older builders) can't be rasterized,
+    # so those meshes look their points up by scanning the boxes
+    if mesh.get('labels') is None and mesh['boxes'] and is_integral(mesh['boxes']):
+        # the image size is not stored in legacy meshes, so cover the boxes
+        shape = (max(b[1] for b in mesh['boxes']), max(b[3] for b in mesh['boxes']))
+        mesh['labels'] = build_labels(mesh, shape)
+
+    if mesh.get('components') is None:
+        mesh['components'] = build_components(mesh)
+
+    if mesh.get('portals') is None:
+        mesh['portals'] = build_portals(mesh)
+
+    arrays = from_dict(mesh).arrays
+    save_arrays(prefix, {name: a for name, a in arrays.items() if name not in existing})
+    return load_array_mesh(prefix)
+
+
+def upgrade_array_mesh(prefix):
+    """ Adds the arrays that newer builds write to a mesh saved in the array format.
+
+    Older meshes lack the components and portals arrays; the searches still work
+    without them, but compute the portals every time a mesh is loaded.
+
+    Returns:
+        The names of the arrays written.
+
+    """
+    mesh = load_array_mesh(prefix)
+    arrays = {}
+    if mesh.get('components') is None:
+        arrays['components'] = build_components(mesh)
+    if mesh.get('portals') is None:
+        arrays['portals'] = build_portals(mesh)
+    save_arrays(prefix, arrays)
+    return list(arrays)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print("usage: %s map.mesh.pickle|map.mesh [...]" % sys.argv[0])
+        sys.exit(-1)
+
+    for filename in sys.argv[1:]:
+        if filename.endswith('.pickle'):
+            mesh = convert_pickle(filename)
+            print("Converted %s (%d boxes)." % (filename, len(mesh)))
+        else:
+            added = upgrade_array_mesh(filename)
+            print("Upgraded %s (%s)." % (filename, ', '.join(added) if added else "already up to date"))
@@ -1,8 +1,85 @@
+import multiprocessing
 import queue
+from collections import OrderedDict
 from math import inf, sqrt
+from time import perf_counter
 from heapq import heappop, heappush
 import random
 
+import numpy
+
+import nm_hierarchy
+import nm_landmarks
+import nm_meshio
+import nm_search
+from nm_stats import SearchStats
+
+
+def load_mesh(filename):
+    """
+    Loads a mesh saved by nm_meshbuilder
+
+    Args:
+        filename: a .mesh.pickle file, or the prefix of a mesh saved in the array
+            format (e.g. 'map.png.mesh')
+
+    Returns:
+        The mesh, with its label raster memory-mapped when one was saved with it
+    """
+    return nm_meshio.load_mesh(filename)
+
+def find_box(point, mesh):
+    """
+    Finds the box of the mesh that contains point
+
+    Uses the mesh's label raster for a constant time lookup when it has one, and
+    falls back to scanning mesh['boxes'] otherwise.
+
+    Args:
+        point: (x, y) coordinates to look up
+        mesh: the mesh to search
+
+    Returns:
+        The box containing point, or None if point is not inside any box
+    """
+    px = point[0]
+    py = point[1]
+
+    labels = mesh.get('labels')
+    if labels is not None:
+        # boxes include their far edges, so a point on the edge of a box
+        # may only be covered by the pixel above or to the left of it
+        x = int(px)
+        y = int(py)
+        for cx, cy in ((x, y), (x - 1, y), (x, y - 1), (x - 1, y - 1)):
+            if 0 <= cx < labels.shape[0] and 0 <= cy < labels.shape[1]:
+                i = labels[cx, cy]
+                if i >= 0:
+                    return mesh['boxes'][i]
+        return None
+
+    for box in mesh['boxes']:
+        if (box[0] <= px and box[1] >= px) and (box[2] <= py and box[3] >= py):
+            return box
+    return None
+
+def box_index(box, mesh):
+    """
+    Returns the index of a box in mesh['boxes'], in constant time when the mesh has a label raster
+
+    The raster gives one box per pixel, so a box whose corner pixel is labeled
+    with another box (e.g. one it overlaps in a legacy mesh) is looked up by value.
+    """
+    labels = mesh.get('labels')
+    if labels is not None:
+        x = int(box[0])
+        y = int(box[2])
+        if 0 <= x < labels.shape[0] and 0 <= y < labels.shape[1]:
+            i = int(labels[x, y])
+            if i >= 0 and tuple(mesh['boxes'][i]) == tuple(box):
+                return i
+    return nm_search.workspace(mesh).mesh.box_id(box)
+
 def find_detail(cur_point, box_curr, box_next):
     # box 1 & 2 x ranges
     b1x = (box_curr[0], box_curr[1])
@@ -17,29 +94,108 @@ def find_detail(cur_point, box_curr, box_next):
     # The "largest" (lowest) upper bound (y1), to the "smallest" (highest) lower bound (y2)
     y_range = (max(b1y[0], b2y[0]), min(b1y[1], b2y[1]))
     
-    # Coordinates of the next detail point (based off current detail point)
+    # Coordinates of the next detail point (based off current detail point),
+    # clamped into the ranges with two comparisons each, which also works for
+    # points and boxes with float coordinates
     new_x = cur_point[0]
+    if new_x < x_range[0]:
+        new_x = x_range[0]
+    elif new_x > x_range[1]:
+        new_x = x_range[1]
     new_y = cur_point[1]
-    
-    # Recalculate the x value of the new detail point if it isn't in range
-    if cur_point[0] not in range(x_range[0], x_range[1] + 1):
-        if cur_point[0] < x_range[0]:
-            new_x = x_range[0]
-        else:
-            new_x = x_range[1]
-            
-    # Recalculate the y value of the new detail point if it isn't in range
-    if cur_point[1] not in range(y_range[0], y_range[1] + 1):
-        if cur_point[1] < y_range[0]:
-            new_y = y_range[0]
-        else:
-            new_y = y_range[1]
+    if new_y < y_range[0]:
+        new_y = y_range[0]
+    elif new_y > y_range[1]:
+        new_y = y_range[1]
     
     new_cords = (new_x, new_y)
     dist = heuristic(cur_point, new_cords)
     return (new_cords, dist)
 
-def find_path (source_point, destination_point, mesh):
+class PathCache:
+    """
+    Bounded LRU cache of box corridors, for agents that repeat queries between the same rooms
+
+    Corridors are keyed by (src_box, dst_box), so any two points in the same pair of
+    boxes share an entry; only the detail points are recomputed for the exact
+    endpoints. The cache empties itself when it is used with a different mesh object,
+    or after the mesh's 'version' changed (see nm_meshbuilder.rebuild_region).
+
+    Args:
+        maxsize: the number of corridors kept before the least recently used is evicted
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.mesh = None
+        self.version = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.mesh = None
+        self.version = None
+
+    def corridor(self, mesh, src_box, dst_box):
+        """
+        Returns the list of boxes from src_box to dst_box, searching on a miss
+
+        Returns:
+            The corridor of boxes, or None if there is no path between them
+        """
+        version = mesh.get('version', 0)
+        if mesh is not self.mesh or version != self.version:
+            self.entries.clear()
+            self.mesh = mesh
+            self.version = version
+
+        key = (src_box, dst_box)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        ws = nm_search.workspace(mesh)
+        src_center = ((src_box[0] + src_box[1]) / 2, (src_box[2] + src_box[3]) / 2)
+        dst_center = ((dst_box[0] + dst_box[1]) / 2, (dst_box[2] + dst_box[3]) / 2)
+        ids, _ = ws.search(src_center, dst_center, ws.mesh.box_id(src_box), ws.mesh.box_id(dst_box))
+        corridor = None
+        if ids is not None:
+            box_tuples = ws.box_tuples()
+            corridor = [box_tuples[i] for i in ids]
+
+        self.entries[key] = corridor
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return corridor
+
+def detail_path(source_point, destination_point, corridor):
+    """
+    Places the detail points of a path along a corridor of boxes
+
+    Args:
+        source_point: starting point, inside corridor[0]
+        destination_point: goal point, inside corridor[-1]
+        corridor: list of adjacent boxes
+
+    Returns:
+        The list of points from source_point to destination_point
+    """
+    path = [source_point]
+    cur_point = source_point
+    for box_curr, box_next in zip(corridor, corridor[1:]):
+        cur_point = find_detail(cur_point, box_curr, box_next)[0]
+        path.append(cur_point)
+    path.append(destination_point)
+    return path
+
+def find_path (source_point, destination_point, mesh, engine='bi_a_star', cache=None, stats=None):
 
     """
     Searches for a path from source_point to destination_point through the mesh
@@ -48,6 +204,19 @@ def find_path (source_point, destination_point, mesh):
         source_point: starting point of the pathfinder
         destination_point: the ultimate goal the pathfinder must reach
         mesh: pathway constraints the path adheres to
+        engine: 'bi_a_star' for the bidirectional search over box tuples,
+            'array' for the A* over box ids with reusable buffers (nm_search),
+            'hpa' for the hierarchical search over regions of boxes (nm_hierarchy), or
+            'nba' for the bidirectional search over box centers (nba_star). Unlike the
+            other engines, which cost a path by the length between its detail points,
+            'nba' finds the corridor with the least distance between consecutive box
+            centers, so its paths and expansion counts aren't comparable with theirs.
+            It does not expand fewer boxes either: up to 10% more than a one-directional
+            A* over centers, and up to 30% more than a_star_shortest_path.
+        cache: an optional PathCache; corridors missing from it are searched
+            with nm_search's A* whatever the engine
+        stats: an optional nm_stats.SearchStats to record the query in, or a
+            callable (e.g. nm_stats.StatsAggregator.record) that receives one
 
     Returns:
 
@@ -57,6 +226,16 @@ def find_path (source_point, destination_point, mesh):
     path = []
     boxes = {}
 
+    callback = None
+    if stats is not None and not isinstance(stats, SearchStats):
+        callback = stats
+        stats = SearchStats()
+    if stats is not None:
+        # a SearchStats can be reused, so nothing is left from its previous query
+        stats.reset()
+        stats.engine = 'cache' if cache is not None else engine
+        start = perf_counter()
+
     # source point x and y cords
     spx = source_point[0]
     spy = source_point[1]
@@ -66,26 +245,27 @@ def find_path (source_point, destination_point, mesh):
     dpy = destination_point[1]
 
     # boxes that holds source and destination cords
-    src_box = None
-    dst_box = None
-
-    # identify source and destination box
-    for box in mesh['boxes']:
-        # kill loop if both found
-        if src_box != None and dst_box != None:
-            break
-        # check if current box is source box
-        if (box[0] <= spx and box[1] >= spx) and (box[2] <= spy and box[3] >= spy):
-            src_box = box
-        # check if current box is destination box
-        if (box[0] <= dpx and box[1] >= dpx) and (box[2] <= dpy and box[3] >= dpy):
-            dst_box = box
+    src_box = find_box(source_point, mesh)
+    dst_box = find_box(destination_point, mesh)
+    if stats is not None:
+        stats.lookup_s = perf_counter() - start
     
     # No path condition
     if (src_box is None) or (dst_box is None):
         print("No path!")
+        report_stats(stats, callback)
         return path, boxes.keys()
 
+    # boxes in different connected components are never joined by a search
+    components = mesh.get('components')
+    if components is not None and components[box_index(src_box, mesh)] != components[box_index(dst_box, mesh)]:
+        print("No path!")
+        report_stats(stats, callback)
+        return path, boxes.keys()
+
+    if stats is not None:
+        start = perf_counter()
+
     """
     ####################################################################
     # adding keys and adj
@@ -150,7 +330,41 @@ def find_path (source_point, destination_point, mesh):
 
     """
 
-    dp_path, dp_box = bi_a_star(source_point, destination_point, src_box, dst_box, mesh)
+    if cache is not None:
+        corridor = cache.corridor(mesh, src_box, dst_box)
+        if corridor is None:
+            print("No Path!")
+            if stats is not None:
+                stats.search_s = perf_counter() - start
+            report_stats(stats, callback)
+            return [],[]
+        if stats is not None:
+            stats.search_s = perf_counter() - start
+            start = perf_counter()
+        dp_path = detail_path(source_point, destination_point, corridor)
+        if stats is not None:
+            stats.reconstruct_s = perf_counter() - start
+            stats.reached = len(corridor)
+            stats.found = True
+        report_stats(stats, callback)
+        return dp_path, corridor
+
+    if engine == 'array':
+        dp_path, dp_box = nm_search.workspace(mesh).find_path(source_point, destination_point, src_box, dst_box)
+    elif engine == 'hpa':
+        dp_path, dp_box = hpa_path(source_point, destination_point, src_box, dst_box, mesh)
+    elif engine == 'bi_a_star':
+        dp_path, dp_box = bi_a_star(source_point, destination_point, src_box, dst_box, mesh, stats)
+    elif engine == 'nba':
+        dp_path, dp_box = nba_star(source_point, destination_point, src_box, dst_box, mesh, stats)
+    else:
+        raise ValueError("unknown engine: %r" % (engine,))
+    if stats is not None:
+        # only bi_a_star times its reconstruction separately
+        stats.search_s = perf_counter() - start - (stats.reconstruct_s or 0.)
+        stats.reached = len(dp_box) if dp_box else 0
+        stats.found = bool(dp_path)
+    report_stats(stats, callback)
     if not dp_path:
         print("No Path!")
         return [],[]
@@ -164,7 +378,48 @@ def find_path (source_point, destination_point, mesh):
     # dp_path.append(destination_point)
     return dp_path, list(dp_box)
 
-def bi_a_star(src_p, dest_p, src_box, dest_box, graph):
+def report_stats(stats, callback):
+    if callback is not None:
+        callback(stats)
+
+def start_search(source_point, destination_point, mesh):
+    """
+    Starts a search that runs a slice at a time, for callers with a per-frame budget
+
+    Args:
+        source_point: starting point of the pathfinder
+        destination_point: the ultimate goal the pathfinder must reach
+        mesh: pathway constraints the path adheres to
+
+    Returns:
+        An nm_search.AnytimeSearch to advance with its step method, or with an
+        nm_search.SearchScheduler shared by many searches; its path method gives
+        the points found so far. It is already done, without a path, when a point
+        is outside the mesh or the points are in different components.
+    """
+    src, dst = find_box_ids([source_point, destination_point], mesh).tolist()
+    components = mesh.get('components')
+    if src >= 0 and dst >= 0 and components is not None and components[src] != components[dst]:
+        src = -1
+    return nm_search.AnytimeSearch(nm_search.workspace(mesh), source_point, destination_point, src, dst)
+
+def hpa_path(src_p, dest_p, src_box, dest_box, mesh):
+    """ Searches for a path with the hierarchical engine.
+
+    Returns:
+        The list of points from src_p to dest_p (empty if there is no path) and
+        the list of boxes the search touched.
+
+    """
+    graph = nm_hierarchy.hierarchy(mesh)
+    box_id = graph.mesh.box_id
+    corridor, touched = graph.find_corridor(box_id(src_box), box_id(dest_box))
+    boxes = [graph.boxes[i] for i in touched]
+    if corridor is None:
+        return [], boxes
+    return detail_path(src_p, dest_p, [graph.boxes[i] for i in corridor]), boxes
+
+def bi_a_star(src_p, dest_p, src_box, dest_box, graph, stats=None):
     """ Searches for a minimal cost path through a graph using the bidirectional A* algorithm.
 
     Args:
@@ -173,6 +428,8 @@ def bi_a_star(src_p, dest_p, src_box, dest_box, graph):
         src_box: The initial cell from which the path extends.
         dest_box: The end cell for the path.
         graph: A loaded level, containing walls, spaces, and waypoints.
+        stats: An optional nm_stats.SearchStats to count heap operations,
+            find_detail calls and frontier sizes in.
 
     Returns:
         If a path exits, return a list containing all cells from src_box to destination.
@@ -194,9 +451,23 @@ def bi_a_star(src_p, dest_p, src_box, dest_box, graph):
     dp_f_box.add(src_box)
     dp_f_box.add(dest_box)
     dp_b_box = dp_f_box.copy()
+    estimate = box_heuristic(graph)
+
+    if stats is not None:
+        stats.pushes = 2
+        # children are pushed at the priority of the box being expanded plus the
+        # fixed cost of their detail point, so priorities only grow and no box is
+        # queued twice in the same direction: there is never a stale entry to skip
+        stats.pops = stats.stale = stats.expanded = stats.find_detail_calls = 0
+        stats.reconstruct_s = 0.
+        frontier = {'destination': 1, 'source': 1}
+        peak = dict(frontier)
 
     while queue:
         priority, cell, cur_goal = heappop(queue)
+        if stats is not None:
+            stats.pops += 1
+            frontier[cur_goal] -= 1
         if cur_goal == 'destination':
             cur_prev = prev_f
             other_prev = prev_b
@@ -218,6 +489,9 @@ def bi_a_star(src_p, dest_p, src_box, dest_box, graph):
 
 
         if (cell in prev_b and goal == dest_box) or (cell in prev_f and goal == src_box):
+            if stats is not None:
+                start = perf_counter()
+                record_frontier(stats, peak)
             path = path_to_cell(cell, cur_prev)
             path_other = path_to_cell(cell, other_prev)
             for i, b in enumerate(path):
@@ -229,9 +503,16 @@ def bi_a_star(src_p, dest_p, src_box, dest_box, graph):
             # path.insert(0, src_p)
             cur_dp_box = cur_dp_box.union(other_dp_box)
             #path.append(dest_p)        
+            if stats is not None:
+                stats.reconstruct_s = perf_counter() - start
             return path, cur_dp_box # FIX THIS
+
+        if stats is not None:
+            stats.expanded += 1
         
         cur_point = cur_dp[cell][0]
+        queued = len(queue)
+        detailed = len(cur_dp)
         # investigate children
         for child in graph['adj'][cell]:
             # find detail point for each child
@@ -243,12 +524,26 @@ def bi_a_star(src_p, dest_p, src_box, dest_box, graph):
             if child not in cur_pathcosts or cost_to_child < cur_pathcosts[child]:
                 cur_dp_box.add(child)
                 cur_pathcosts[child] = cost_to_child # update the cost
-                p = cost_to_child + heuristic(child, goal) # adding estimated distance
+                p = cost_to_child + estimate(child, goal) # adding estimated distance
                 cur_prev[child] = cell                         # set the backpointer
                 heappush(queue, (p, child, cur_goal))     # put the child on the priority queue
+
+        if stats is not None:
+            pushed = len(queue) - queued
+            stats.pushes += pushed
+            stats.find_detail_calls += len(cur_dp) - detailed
+            frontier[cur_goal] += pushed
+            if frontier[cur_goal] > peak[cur_goal]:
+                peak[cur_goal] = frontier[cur_goal]
             
+    if stats is not None:
+        record_frontier(stats, peak)
     return False, False
 
+def record_frontier(stats, peak):
+    stats.frontier_forward = peak['destination']
+    stats.frontier_backward = peak['source']
+
 def a_star_shortest_path(src_p, dest_p, src_box, dest_box, graph):
     """ Searches for a minimal cost path through a graph using the A* algorithm.
 
@@ -303,11 +598,412 @@ def a_star_shortest_path(src_p, dest_p, src_box, dest_box, graph):
             
     return False, False
 
+def box_center(box):
+    return ((box[0] + box[1]) / 2, (box[2] + box[3]) / 2)
+
+def nba_star(src_p, dest_p, src_box, dest_box, graph, stats=None):
+    """ Searches for a minimal cost corridor with bidirectional A* (see nba_corridor)
+    and places the detail points along it with detail_path.
+
+    Returns:
+        If a path exists, the list of points from src_p to dest_p and the set of
+        boxes the search reached. Otherwise, False, False.
+
+    """
+    corridor, reached = nba_corridor(src_box, dest_box, graph, stats)
+    if corridor is None:
+        return False, False
+    return detail_path(src_p, dest_p, corridor), reached
+
+def nba_corridor(src_box, dest_box, graph, stats=None):
+    """ Searches for a minimal cost corridor between two boxes with bidirectional A* (NBA*).
+
+    Unlike bi_a_star, each direction has its own queue, the search expands
+    whichever frontier is smaller, and it only stops once no path through
+    either frontier can beat the best meeting found, so the corridor is optimal.
+    Boxes expanded by one direction are never expanded by the other, and boxes
+    that can't improve on the best meeting are pruned without being expanded.
+
+    Costs between adjacent boxes are the distances between their centers, as in
+    nm_hierarchy, and the heuristics the distances from a box's center to the
+    centers of src_box and dest_box, which never overestimate them.
+
+    What it gains over bi_a_star is optimality, not speed: on the shipped maps it
+    expands up to 10% more boxes than a one-directional A* with the same costs,
+    and up to 30% more than a_star_shortest_path, whose heuristic overestimates.
+
+    Args:
+        src_box: The initial cell from which the path extends.
+        dest_box: The end cell for the path.
+        graph: A loaded level, containing walls, spaces, and waypoints.
+        stats: An optional nm_stats.SearchStats to count heap operations and
+            frontier sizes in.
+
+    Returns:
+        The list of boxes from src_box to dest_box, or None if there is no path,
+        and the set of boxes the search reached.
+
+    """
+    adj = graph['adj']
+    targets = (box_center(dest_box), box_center(src_box))
+    centers = {}
+
+    def center(box):
+        c = centers.get(box)
+        if c is None:
+            c = centers[box] = box_center(box)
+        return c
+
+    def estimate(box, side):
+        return euclidean_dist(center(box), targets[side])
+
+    # index 0 is the forward search from src_box, 1 the backward one from dest_box
+    costs = ({src_box: 0}, {dest_box: 0})
+    prev = ({src_box: []}, {dest_box: []})
+    queues = ([(estimate(src_box, 0), src_box)], [(estimate(dest_box, 1), dest_box)])
+    # lowest f of each queue, a lower bound of any path through that frontier
+    lowest = [queues[0][0][0], queues[1][0][0]]
+    closed = set()
+    best = 0 if src_box == dest_box else inf
+    meeting = src_box if src_box == dest_box else None
+
+    if stats is not None:
+        stats.pushes = 2
+        stats.pops = stats.stale = stats.expanded = 0
+        peak = {'destination': 1, 'source': 1}
+
+    while queues[0] and queues[1] and lowest[0] < best and lowest[1] < best:
+        side = 0 if len(queues[0]) <= len(queues[1]) else 1
+        other = 1 - side
+        queue = queues[side]
+        cur_costs = costs[side]
+        other_costs = costs[other]
+        _, cell = heappop(queue)
+        if stats is not None:
+            stats.pops += 1
+        if cell in closed:
+            if stats is not None:
+                stats.stale += 1
+        else:
+            closed.add(cell)
+            cost = cur_costs[cell]
+            # prune boxes that can't lead to a better meeting, in either direction
+            if cost + estimate(cell, side) < best and cost + lowest[other] - estimate(cell, other) < best:
+                if stats is not None:
+                    stats.expanded += 1
+                cell_center = center(cell)
+                for child in adj[cell]:
+                    if child in closed:
+                        continue
+                    cost_to_child = cost + euclidean_dist(cell_center, center(child))
+                    if cost_to_child < cur_costs.get(child, inf):
+                        cur_costs[child] = cost_to_child
+                        prev[side][child] = cell
+                        heappush(queue, (cost_to_child + estimate(child, side), child))
+                        if stats is not None:
+                            stats.pushes += 1
+                        if child in other_costs and cost_to_child + other_costs[child] < best:
+                            best = cost_to_child + other_costs[child]
+                            meeting = child
+                if stats is not None:
+                    key = 'destination' if side == 0 else 'source'
+                    peak[key] = max(peak[key], len(queue))
+        if queue:
+            lowest[side] = queue[0][0]
+
+    if stats is not None:
+        record_frontier(stats, peak)
+    reached = set(costs[0]).union(costs[1])
+    if meeting is None:
+        return None, reached
+
+    corridor = path_to_cell(meeting, prev[0])
+    cell = prev[1][meeting]
+    while cell != []:
+        corridor.append(cell)
+        cell = prev[1][cell]
+    return corridor, reached
+
+class FlowField:
+    """
+    Cost-to-goal and next-box tables of every box of a mesh, for agents sharing a destination
+
+    Box i (the index into mesh['boxes']) reaches the goal through box next_box[i],
+    entering it at detail[i], and the path from there costs cost[i]. The goal box
+    has next_box -1 and cost 0; boxes that can't reach it have next_box -1 and an
+    infinite cost.
+    """
+
+    def __init__(self, mesh, destination_point, goal, cost, next_box, detail):
+        self.mesh = mesh
+        self.destination_point = destination_point
+        self.goal = goal
+        self.cost = cost
+        self.next_box = next_box
+        self.detail = detail
+
+    def box_of(self, point):
+        box = find_box(point, self.mesh)
+        return None if box is None else box_index(box, self.mesh)
+
+    def cost_to_goal(self, point):
+        """
+        Returns the cost of the route from point to the destination, inf if there is none
+        """
+        i = self.box_of(point)
+        if i is None or self.cost[i] == inf:
+            return inf
+        if i == self.goal:
+            return euclidean_dist(point, self.destination_point)
+        return euclidean_dist(point, self.detail[i]) + float(self.cost[i])
+
+    def route(self, point):
+        """
+        Walks the tables from point to the destination
+
+        Returns:
+            The list of points from point to the destination, or [] if there is no path
+        """
+        i = self.box_of(point)
+        if i is None or self.cost[i] == inf:
+            return []
+        path = [point]
+        next_box = self.next_box
+        detail = self.detail
+        while i != self.goal:
+            path.append(tuple(detail[i].tolist()))
+            i = int(next_box[i])
+        path.append(self.destination_point)
+        return path
+
+def flow_field(destination_point, mesh):
+    """
+    Runs a single Dijkstra pass outwards from destination_point over mesh['adj']
+
+    It expands boxes like a_star_shortest_path without a heuristic, placing the
+    detail points with find_detail, but starts from the goal and keeps going
+    until every reachable box is settled.
+
+    Args:
+        destination_point: the point every agent is heading to
+        mesh: the mesh to search
+
+    Returns:
+        A FlowField, or None if destination_point is not inside any box
+    """
+    dst_box = find_box(destination_point, mesh)
+    if dst_box is None:
+        return None
+
+    boxes = mesh['boxes']
+    ids = {box: i for i, box in enumerate(boxes)}
+    pathcosts = {dst_box: 0}       # maps cells to their pathcosts (found so far)
+    paths = {dst_box: None}        # maps cells to the next cell towards the goal
+    dp = {dst_box: destination_point}
+    closed = set()
+    queue = [(0, dst_box)]
+    while queue:
+        priority, cell = heappop(queue)
+        if cell in closed:
+            continue
+        closed.add(cell)
+
+        cur_point = dp[cell]
+        for child in mesh['adj'][cell]:
+            if child in closed:
+                continue
+            new_point, dist = find_detail(cur_point, cell, child)
+            cost_to_child = priority + dist
+            if child not in pathcosts or cost_to_child < pathcosts[child]:
+                pathcosts[child] = cost_to_child
+                paths[child] = cell
+                dp[child] = new_point
+                heappush(queue, (cost_to_child, child))
+
+    n = len(boxes)
+    cost = numpy.full(n, inf)
+    next_box = numpy.full(n, -1, dtype=numpy.int32)
+    detail = numpy.zeros((n, 2))
+    for cell in closed:
+        i = ids[cell]
+        cost[i] = pathcosts[cell]
+        detail[i] = dp[cell]
+        if paths[cell] is not None:
+            next_box[i] = ids[paths[cell]]
+    return FlowField(mesh, destination_point, ids[dst_box], cost, next_box, detail)
+
+# smallest group of queries with the same source point that find_paths answers with one search tree
+TREE_MIN_GROUP = 8
+
+
+def find_box_ids(points, mesh):
+    """
+    Finds the ids of the boxes containing many points at once
+
+    With a label raster, all points are looked up in one vectorized pass, trying
+    the same neighboring pixels as find_box; otherwise each point is scanned for.
+
+    Args:
+        points: sequence of (x, y) points
+        mesh: the mesh to search
+
+    Returns:
+        An int array of box ids (indices into mesh['boxes']), -1 for points outside every box
+    """
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+    labels = mesh.get('labels')
+    if labels is None:
+        boxes = [find_box(point, mesh) for point in points.tolist()]
+        return numpy.array([-1 if box is None else box_index(box, mesh) for box in boxes], dtype=numpy.int64)
+
+    # truncated like int() in find_box
+    x = numpy.trunc(points[:, 0]).astype(numpy.int64)
+    y = numpy.trunc(points[:, 1]).astype(numpy.int64)
+    ids = numpy.full(len(points), -1, dtype=numpy.int64)
+    for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+        cx = x - dx
+        cy = y - dy
+        todo = (ids < 0) & (cx >= 0) & (cx < labels.shape[0]) & (cy >= 0) & (cy < labels.shape[1])
+        ids[todo] = labels[cx[todo], cy[todo]]
+    return ids
+
+def find_paths(pairs, mesh, pool=None):
+    """
+    Searches for the paths of many (source_point, destination_point) pairs at once
+
+    Endpoints are resolved together with find_box_ids, and queries are grouped by
+    the box of their source point. Within a group, each set of at least
+    TREE_MIN_GROUP queries from the same source point (see share_trees) grows one
+    search tree from it (nm_search.SearchWorkspace.search_tree) until it has
+    reached all of their destination boxes; the other queries run one A* each.
+    Every path is then placed along its corridor with detail_path, like the
+    corridors of PathCache. A tree settles boxes in a different order than A*,
+    so its corridors can differ where detail points make two of them about as
+    long: on the shipped maps, its paths are as long as find_path(engine='array')'s
+    on average, and at most a fifth longer.
+
+    Args:
+        pairs: list of (source_point, destination_point)
+        mesh: the mesh to search
+        pool: an optional process pool made by batch_pool for the same mesh, to
+            search the groups in parallel
+
+    Returns:
+        The list of paths (lists of points) in the order of pairs, [] where there is no path
+    """
+    pairs = list(pairs)
+    ids = find_box_ids([point for pair in pairs for point in pair], mesh)
+    src_ids = ids[0::2]
+    dst_ids = ids[1::2]
+    valid = (src_ids >= 0) & (dst_ids >= 0)
+    components = mesh.get('components')
+    if components is not None:
+        components = numpy.asarray(components)
+        valid &= components[src_ids] == components[dst_ids]
+
+    groups = {}
+    for i in numpy.flatnonzero(valid).tolist():
+        source_point, destination_point = pairs[i]
+        groups.setdefault(int(src_ids[i]), []).append((i, source_point, destination_point, int(dst_ids[i])))
+
+    paths = [[] for _ in pairs]
+    items = list(groups.items())
+    if pool is not None and len(items) > 1:
+        # map sends the groups in a few chunks per worker, so that uneven groups still balance out
+        results = [result for group in pool.map(_path_group, items) for result in group]
+    else:
+        results = search_groups(nm_search.workspace(mesh), items)
+    for i, path in results:
+        paths[i] = path
+    return paths
+
+def search_groups(ws, groups):
+    """
+    Answers groups of queries sharing a source box, with one search tree per source point of many queries
+
+    Args:
+        ws: the nm_search.SearchWorkspace of the mesh
+        groups: list of (source box id, list of (index, source_point, destination_point, destination box id))
+
+    Returns:
+        The list of (index, path) of the queries that have a path
+    """
+    box_tuples = ws.box_tuples()
+    results = []
+    for src, queries in groups:
+        for root, members in share_trees(queries):
+            if len(members) < TREE_MIN_GROUP:
+                # a few destinations are cheaper to reach with one A* each, from the exact points
+                for i, source_point, destination_point, dst in members:
+                    ids, _ = ws.search(source_point, destination_point, src, dst)
+                    if ids is not None:
+                        results.append((i, detail_path(source_point, destination_point, [box_tuples[j] for j in ids])))
+                continue
+
+            found, _ = ws.search_tree(root, src, [query[3] for query in members])
+            corridors = {dst: [box_tuples[i] for i in ws.corridor(dst)] for dst in found}
+            for i, source_point, destination_point, dst in members:
+                if dst in corridors:
+                    results.append((i, detail_path(source_point, destination_point, corridors[dst])))
+    return results
+
+def share_trees(queries):
+    """
+    Splits queries sharing a source box by their source point, the root of the search tree they can share
+
+    A tree grown from another point, even one a pixel away, gives corridors
+    chosen for the wrong start, so only queries from the very same point share one.
+
+    Returns:
+        The list of (source point, list of queries)
+    """
+    trees = {}
+    for query in queries:
+        trees.setdefault(tuple(query[1]), []).append(query)
+    return list(trees.items())
+
+def batch_pool(mesh, workers):
+    """
+    Starts a process pool for find_paths, each worker holding its own copy of the mesh's arrays
+
+    The pool is meant to be kept for many calls (e.g. one per game tick), and closed by the caller.
+    """
+    return multiprocessing.Pool(workers, _init_batch_worker, (nm_meshio.from_dict(mesh).arrays,))
+
+# the workspace of the mesh a batch worker searches
+_batch_workspace = None
+
+def _init_batch_worker(arrays):
+    global _batch_workspace
+    _batch_workspace = nm_search.SearchWorkspace(nm_meshio.ArrayMesh(arrays))
+
+def _path_group(group):
+    return search_groups(_batch_workspace, [group])
+
 def path_to_cell(cell, paths):
-    if cell == []:
-        return []
-    return path_to_cell(paths[cell], paths) + [cell]
+    path = []
+    while cell != []:
+        path.append(cell)
+        cell = paths[cell]
+    path.reverse()
+    return path
     
+def box_heuristic(mesh):
+    """
+    Returns the heuristic between two boxes to search the mesh with
+
+    Meshes with landmarks (see nm_landmarks) get the larger of heuristic and the
+    landmarks' triangle-inequality lower bound; other meshes get heuristic itself.
+    """
+    if mesh.get('landmark_dist') is None:
+        return heuristic
+
+    rows = nm_search.workspace(mesh).box_landmark_rows()
+
+    def estimate(a, b):
+        return max(heuristic(a, b), nm_landmarks.lower_bound(rows[a], rows[b]))
+    return estimate
+
 def heuristic(a, b):
     return euclidean_dist(a, b)
 
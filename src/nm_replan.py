@@ -0,0 +1,289 @@
+""" Runtime blocking of a box mesh, and incremental replanning (D* Lite) around it.
+
+A MeshOverlay marks boxes or edges of a mesh as blocked or more costly, without
+touching the mesh itself, and tells its Replanners which boxes each change
+affects. A Replanner
+keeps the D* Lite state of one agent's query between calls: after the overlay
+changes or the agent moves, only the boxes whose cost to the goal changed are
+expanded again, instead of searching from scratch.
+
+Like nm_hierarchy, the search costs moving between adjacent boxes by the
+distance between their centers; the corridor it finds is then turned into
+points with nm_pathfinder.detail_path.
+
+"""
+import weakref
+from heapq import heappop, heappush
+from math import inf, sqrt
+
+import nm_pathfinder
+import nm_search
+
+
+class MeshOverlay:
+    """ Blocked and costed boxes and edges on top of a mesh.
+
+    Costs are factors of at least 1 applied to the base cost of moving between
+    two boxes: a box's factor applies to the half of each of its edges inside
+    it, so an edge between boxes with factors a and b costs (a + b) / 2 times
+    its base, times the factor of the edge itself. Blocking sets a factor to
+    infinity.
+
+    Boxes can be given as tuples, as keys of mesh['adj'], or as box ids.
+
+    Args:
+        mesh: A dict mesh built by nm_meshbuilder, or an ArrayMesh.
+
+    Attributes:
+        version: The number of changes made so far.
+        replanners: The Replanners on this overlay, held weakly, whose dirty
+            sets each change adds the boxes it affects to.
+
+    """
+
+    def __init__(self, mesh):
+        ws = nm_search.workspace(mesh)
+        self.mesh = ws.mesh
+        self.boxes = ws.box_tuples()
+        self.offsets = ws.offsets
+        self.neighbors = ws.neighbors
+        coords = ws.box_coords
+        self.center_x = [(coords[c] + coords[c + 1]) / 2 for c in range(0, len(coords), 4)]
+        self.center_y = [(coords[c + 2] + coords[c + 3]) / 2 for c in range(0, len(coords), 4)]
+        self.box_factor = {}
+        self.edge_factor = {}
+        self.version = 0
+        self.replanners = weakref.WeakSet()
+
+    def box_id(self, box):
+        return self.mesh.box_id(tuple(box)) if isinstance(box, (tuple, list)) else int(box)
+
+    def changed(self, boxes):
+        """ Records a change to the edge costs of the given box ids. """
+        self.version += 1
+        for replanner in self.replanners:
+            replanner.dirty.update(boxes)
+
+    def edge_ids(self, i):
+        """ Returns the ids of the boxes adjacent to box i. """
+        return self.neighbors[self.offsets[i]:self.offsets[i + 1]]
+
+    def set_box_cost(self, box, factor):
+        """ Sets the cost factor of a box; 1 restores its base cost. """
+        if not factor >= 1:
+            raise ValueError("cost factors must be at least 1, got %r" % (factor,))
+        i = self.box_id(box)
+        if factor == 1:
+            self.box_factor.pop(i, None)
+        else:
+            self.box_factor[i] = factor
+        self.changed([i, *self.edge_ids(i)])
+
+    def set_edge_cost(self, a, b, factor):
+        """ Sets the cost factor of the edge between two adjacent boxes; 1 restores its base cost. """
+        if not factor >= 1:
+            raise ValueError("cost factors must be at least 1, got %r" % (factor,))
+        i = self.box_id(a)
+        j = self.box_id(b)
+        if j not in self.edge_ids(i):
+            raise ValueError("boxes %r and %r are not adjacent" % (a, b))
+        key = (i, j) if i < j else (j, i)
+        if factor == 1:
+            self.edge_factor.pop(key, None)
+        else:
+            self.edge_factor[key] = factor
+        self.changed(key)
+
+    def block_box(self, box):
+        self.set_box_cost(box, inf)
+
+    def unblock_box(self, box):
+        self.set_box_cost(box, 1)
+
+    def block_edge(self, a, b):
+        self.set_edge_cost(a, b, inf)
+
+    def unblock_edge(self, a, b):
+        self.set_edge_cost(a, b, 1)
+
+    def distance(self, i, j):
+        """ Returns the distance between the centers of two boxes. """
+        return sqrt((self.center_x[i] - self.center_x[j]) ** 2 + (self.center_y[i] - self.center_y[j]) ** 2)
+
+    def cost(self, i, j):
+        """ Returns the cost of moving between two adjacent boxes, inf if it is blocked. """
+        factor = 1.
+        if self.box_factor:
+            factor = (self.box_factor.get(i, 1.) + self.box_factor.get(j, 1.)) / 2
+        if self.edge_factor:
+            factor *= self.edge_factor.get((i, j) if i < j else (j, i), 1.)
+        if factor == inf:
+            return inf
+        return factor * self.distance(i, j)
+
+
+class Replanner:
+    """ The D* Lite search of one agent's route through a MeshOverlay.
+
+    The search runs backwards from the goal, so its costs stay valid as the
+    agent moves; move_to only changes the box the heuristic aims at. Changes to
+    the overlay are picked up the next time path is called, and only the boxes
+    they make inconsistent are expanded again.
+
+    Args:
+        overlay: The MeshOverlay of the mesh.
+        source_point: Where the agent starts.
+        destination_point: The goal, which stays fixed.
+
+    Attributes:
+        expanded: The number of boxes expanded by the last replan.
+        dirty: The ids of the boxes whose edge costs changed since the last
+            replan, filled in by the overlay.
+
+    """
+
+    def __init__(self, overlay, source_point, destination_point):
+        self.overlay = overlay
+        self.destination_point = destination_point
+        self.dirty = set()
+        overlay.replanners.add(self)
+        self.expanded = 0
+        self.g = {}
+        self.rhs = {}
+        self.keys = {}
+        self.queue = []
+        self.km = 0.
+
+        mesh = overlay.mesh
+        self.point = source_point
+        self.start, self.goal = nm_pathfinder.find_box_ids([source_point, destination_point], mesh).tolist()
+        components = mesh.get('components')
+        if self.start >= 0 and self.goal >= 0 and components is not None and \
+                components[self.start] != components[self.goal]:
+            # blocking never joins components, so there will never be a path
+            self.goal = -1
+        if self.goal >= 0:
+            self.rhs[self.goal] = 0.
+            if self.start >= 0:
+                self.push(self.goal)
+
+    def key(self, u):
+        m = min(self.g.get(u, inf), self.rhs.get(u, inf))
+        return (m + self.overlay.distance(self.start, u) + self.km, m)
+
+    def push(self, u):
+        key = self.key(u)
+        self.keys[u] = key
+        heappush(self.queue, (key[0], key[1], u))
+
+    def update_vertex(self, u):
+        overlay = self.overlay
+        g = self.g
+        if u != self.goal:
+            best = inf
+            for v in overlay.edge_ids(u):
+                cost = overlay.cost(u, v) + g.get(v, inf)
+                if cost < best:
+                    best = cost
+            self.rhs[u] = best
+        if g.get(u, inf) != self.rhs.get(u, inf):
+            self.push(u)
+        else:
+            self.keys.pop(u, None)
+
+    def move_to(self, point):
+        """ Moves the agent, which doesn't invalidate the search.
+
+        Returns:
+            False if point is outside the mesh, in which case the agent isn't moved.
+
+        """
+        start = int(nm_pathfinder.find_box_ids([point], self.overlay.mesh)[0])
+        if start < 0:
+            return False
+        self.point = point
+        if self.start < 0:
+            # nothing was searched yet, for lack of a box to aim at
+            self.start = start
+            if self.goal >= 0:
+                self.push(self.goal)
+        elif start != self.start and self.goal >= 0:
+            self.km += self.overlay.distance(self.start, start)
+            self.start = start
+        return True
+
+    def replan(self):
+        """ Applies the overlay's new changes and brings the costs to the goal up
+        to date for the agent's box.
+
+        Returns:
+            The number of boxes expanded.
+
+        """
+        if self.start < 0 or self.goal < 0:
+            return 0
+        dirty = self.dirty
+        self.dirty = set()
+        for u in dirty:
+            self.update_vertex(u)
+
+        overlay = self.overlay
+        queue = self.queue
+        keys = self.keys
+        g = self.g
+        rhs = self.rhs
+        start = self.start
+        expanded = 0
+        while queue:
+            k1, k2, u = queue[0]
+            if keys.get(u) != (k1, k2):
+                # superseded or no longer inconsistent
+                heappop(queue)
+                continue
+            if (k1, k2) >= self.key(start) and rhs.get(start, inf) == g.get(start, inf):
+                break
+            heappop(queue)
+            del keys[u]
+            key = self.key(u)
+            if (k1, k2) < key:
+                self.push(u)
+                continue
+            expanded += 1
+            if g.get(u, inf) > rhs.get(u, inf):
+                g[u] = rhs[u]
+            else:
+                g[u] = inf
+                self.update_vertex(u)
+            for v in overlay.edge_ids(u):
+                self.update_vertex(v)
+        self.expanded = expanded
+        return expanded
+
+    def corridor(self):
+        """ Returns the box ids from the agent's box to the goal, or None if there is no path. """
+        self.replan()
+        if self.start < 0 or self.goal < 0 or self.g.get(self.start, inf) == inf:
+            return None
+        overlay = self.overlay
+        g = self.g
+        corridor = [self.start]
+        u = self.start
+        while u != self.goal and len(corridor) <= len(overlay.boxes):
+            best, best_cost = None, inf
+            for v in overlay.edge_ids(u):
+                cost = overlay.cost(u, v) + g.get(v, inf)
+                if cost < best_cost:
+                    best, best_cost = v, cost
+            if best is None:
+                return None
+            corridor.append(best)
+            u = best
+        return corridor if u == self.goal else None
+
+    def path(self):
+        """ Returns the list of points from the agent to the destination, [] if there is no path. """
+        corridor = self.corridor()
+        if corridor is None:
+            return []
+        boxes = self.overlay.boxes
+        return nm_pathfinder.detail_path(self.point, self.destination_point, [boxes[i] for i in corridor])
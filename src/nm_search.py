@@ -0,0 +1,535 @@
+from collections import OrderedDict, deque
+from heapq import heappop, heappush
+from math import inf, sqrt
+from time import perf_counter
+
+import numpy
+
+import nm_meshio
+from nm_landmarks import lower_bound
+
+
+class SearchWorkspace:
+    """ Box-id based A* over an ArrayMesh, with buffers reused between queries.
+
+    Every per-box value (path cost, backpointer, detail point) lives in a flat
+    list sized to the mesh. Instead of clearing them before each query, each
+    query bumps a generation counter, and a box's entries only count as set
+    when its stamp matches the current generation.
+
+    Plain lists are used rather than array.array or memoryviews of the mesh
+    arrays because CPython indexes them about twice as fast. With copy=False,
+    the mesh arrays are read through memoryviews instead, so that processes
+    mapping the same arrays (see nm_server) don't each hold a copy of the mesh;
+    only the per-query buffers are private.
+
+    Detail points are clamped into the mesh's portals, the borders stored for
+    every edge (computed here for meshes saved without them). Boxes and portals
+    keep the type of the mesh's coordinates, float for legacy meshes (see
+    nm_meshio.from_dict), so box ids are found from the mesh's own box tuples.
+
+    If the mesh has landmarks (see nm_landmarks), the heuristic is the larger of
+    the straight-line distance and the landmarks' triangle-inequality bound.
+
+    """
+
+    def __init__(self, mesh, copy=True):
+        mesh = nm_meshio.from_dict(mesh)
+        n = len(mesh)
+        self.mesh = mesh
+        self.copy = copy
+        portals = mesh.get('portals')
+        if portals is None:
+            # meshes saved before portals were stored, or edited since
+            portals = nm_meshio.build_portals(mesh)
+        flat = self.flat_list if copy else self.flat_view
+        self.box_coords = flat(mesh.boxes)
+        self.offsets = flat(mesh.offsets)
+        self.neighbors = flat(mesh.neighbors)
+        self.portals = flat(portals)
+        self._box_tuples = None
+        landmark_dist = mesh.get('landmark_dist')
+        if landmark_dist is not None and copy:
+            landmark_dist = landmark_dist.tolist()
+        self.landmark_rows = landmark_dist
+        self._box_landmark_rows = None
+
+        self.generation = 0
+        self.seen = [0] * n
+        self.closed = [0] * n
+        self.cost = [0.] * n
+        self.back = [0] * n
+        self.detail_x = [0.] * n
+        self.detail_y = [0.] * n
+        self.bound = [0.] * n
+
+    @staticmethod
+    def flat_list(array):
+        return numpy.asarray(array).reshape(-1).tolist()
+
+    @staticmethod
+    def flat_view(array):
+        return memoryview(numpy.ascontiguousarray(array).reshape(-1))
+
+    def next_generation(self):
+        """ Starts a new query, invalidating everything stored by the previous one. """
+        self.generation += 1
+        return self.generation
+
+    def box_tuples(self):
+        """ Returns the sequence of all boxes as tuples: a list built on first use,
+        or a view of the mesh's boxes array if the workspace doesn't copy it. """
+        if self._box_tuples is None:
+            boxes = nm_meshio.BoxList(self.mesh)
+            self._box_tuples = list(boxes) if self.copy else boxes
+        return self._box_tuples
+
+    def box_landmark_rows(self):
+        """ Returns a dict from box tuples to their landmark distances, built on first use. """
+        if self._box_landmark_rows is None:
+            self._box_landmark_rows = dict(zip(self.box_tuples(), self.landmark_rows))
+        return self._box_landmark_rows
+
+    def search(self, src_p, dest_p, src, dest):
+        """ Searches for a minimal cost path between two boxes using A*.
+
+        Detail points are moved into the border shared with the next box, and the
+        heuristic is the straight-line distance from a box's detail point to dest_p.
+
+        Args:
+            src_p: initial point
+            dest_p: destination point
+            src: id of the box containing src_p
+            dest: id of the box containing dest_p
+
+        Returns:
+            If a path exists, the list of box ids from src to dest and the list of
+            box ids reached by the search. Otherwise, None and the reached boxes.
+
+        """
+        gen = self.next_generation()
+        portals = self.portals
+        offsets = self.offsets
+        neighbors = self.neighbors
+        seen = self.seen
+        closed = self.closed
+        cost = self.cost
+        back = self.back
+        detail_x = self.detail_x
+        detail_y = self.detail_y
+        bound = self.bound
+        rows = self.landmark_rows
+        goal_row = None if rows is None else rows[dest]
+        gx, gy = dest_p
+
+        seen[src] = gen
+        cost[src] = 0.
+        back[src] = -1
+        detail_x[src], detail_y[src] = src_p
+        reached = [src]
+
+        queue = [(sqrt((src_p[0] - gx) ** 2 + (src_p[1] - gy) ** 2), src)]
+        while queue:
+            _, cell = heappop(queue)
+            if closed[cell] == gen:
+                continue
+            closed[cell] = gen
+
+            if cell == dest:
+                return self.corridor(dest), reached
+
+            cx = detail_x[cell]
+            cy = detail_y[cell]
+            cell_cost = cost[cell]
+
+            for k in range(offsets[cell], offsets[cell + 1]):
+                child = neighbors[k]
+                if closed[child] == gen:
+                    continue
+
+                # clamp the detail point into the border shared by both boxes
+                p = 4 * k
+                lo = portals[p]
+                hi = portals[p + 1]
+                nx = lo if cx < lo else hi if cx > hi else cx
+                lo = portals[p + 2]
+                hi = portals[p + 3]
+                ny = lo if cy < lo else hi if cy > hi else cy
+
+                cost_to_child = cell_cost + sqrt((nx - cx) ** 2 + (ny - cy) ** 2)
+                if seen[child] != gen:
+                    seen[child] = gen
+                    reached.append(child)
+                    if goal_row is not None:
+                        bound[child] = lower_bound(rows[child], goal_row)
+                elif cost_to_child >= cost[child]:
+                    continue
+
+                cost[child] = cost_to_child
+                back[child] = cell
+                detail_x[child] = nx
+                detail_y[child] = ny
+                h = sqrt((nx - gx) ** 2 + (ny - gy) ** 2)
+                if goal_row is not None and bound[child] > h:
+                    h = bound[child]
+                heappush(queue, (cost_to_child + h, child))
+
+        return None, reached
+
+    def search_tree(self, src_p, src, targets):
+        """ Grows one shortest-path tree from a box until it reaches all target boxes.
+
+        It is Dijkstra's algorithm with the costs of search, stopped once every
+        target is settled or the reachable boxes run out, so the corridor to any
+        reached target can then be read with corridor, for the price of one search.
+
+        Args:
+            src_p: the point the tree starts from
+            src: id of the box containing src_p
+            targets: ids of the boxes to reach
+
+        Returns:
+            The set of targets reached, and the list of box ids reached.
+
+        """
+        gen = self.next_generation()
+        portals = self.portals
+        offsets = self.offsets
+        neighbors = self.neighbors
+        seen = self.seen
+        closed = self.closed
+        cost = self.cost
+        back = self.back
+        detail_x = self.detail_x
+        detail_y = self.detail_y
+
+        seen[src] = gen
+        cost[src] = 0.
+        back[src] = -1
+        detail_x[src], detail_y[src] = src_p
+        reached = [src]
+        remaining = set(targets)
+        found = set()
+
+        queue = [(0., src)]
+        while queue and remaining:
+            cell_cost, cell = heappop(queue)
+            if closed[cell] == gen:
+                continue
+            closed[cell] = gen
+            if cell in remaining:
+                remaining.discard(cell)
+                found.add(cell)
+
+            cx = detail_x[cell]
+            cy = detail_y[cell]
+
+            for k in range(offsets[cell], offsets[cell + 1]):
+                child = neighbors[k]
+                if closed[child] == gen:
+                    continue
+
+                p = 4 * k
+                lo = portals[p]
+                hi = portals[p + 1]
+                nx = lo if cx < lo else hi if cx > hi else cx
+                lo = portals[p + 2]
+                hi = portals[p + 3]
+                ny = lo if cy < lo else hi if cy > hi else cy
+
+                cost_to_child = cell_cost + sqrt((nx - cx) ** 2 + (ny - cy) ** 2)
+                if seen[child] != gen:
+                    seen[child] = gen
+                    reached.append(child)
+                elif cost_to_child >= cost[child]:
+                    continue
+
+                cost[child] = cost_to_child
+                back[child] = cell
+                detail_x[child] = nx
+                detail_y[child] = ny
+                heappush(queue, (cost_to_child, child))
+
+        return found, reached
+
+    def corridor(self, cell):
+        """ Follows backpointers from cell to the start of the last search. """
+        back = self.back
+        path = []
+        while cell != -1:
+            path.append(cell)
+            cell = back[cell]
+        path.reverse()
+        return path
+
+    def detail_points(self, corridor):
+        """ Returns the detail points of the last search along a corridor of box ids. """
+        return [(self.detail_x[i], self.detail_y[i]) for i in corridor]
+
+    def find_path(self, source_point, destination_point, src_box, dst_box):
+        """ Runs a search between two box tuples of the mesh.
+
+        Returns:
+            The list of points from source_point to destination_point (empty if
+            there is no path) and the list of boxes reached by the search.
+
+        """
+        mesh = self.mesh
+        corridor, reached = self.search(source_point, destination_point,
+                                        mesh.box_id(src_box), mesh.box_id(dst_box))
+        box_tuples = self.box_tuples()
+        boxes = [box_tuples[i] for i in reached]
+        if corridor is None:
+            return [], boxes
+        return self.detail_points(corridor) + [destination_point], boxes
+
+
+# how many expansions AnytimeSearch.step makes between checks of its deadline
+CHECK_INTERVAL = 16
+
+
+class AnytimeSearch:
+    """ An A* query over a SearchWorkspace's mesh that runs a slice at a time.
+
+    Frame-bound callers start one per query and call step with a budget of
+    expansions or seconds; the frontier is kept between calls. Until the goal is
+    reached, partial_corridor leads to the expanded box whose detail point is
+    closest to dest_p, so an agent can start moving before the search finishes.
+
+    The costs and backpointers live in dicts holding only the boxes reached,
+    rather than in the workspace's buffers, so any number of searches can be in
+    progress on the same mesh.
+
+    Args:
+        ws: the SearchWorkspace of the mesh
+        src_p: initial point
+        dest_p: destination point
+        src: id of the box containing src_p, or -1 if there is none
+        dest: id of the box containing dest_p, or -1 if there is none
+
+    Attributes:
+        done: whether the search has finished
+        corridor: the list of box ids from src to dest once found, else None
+        expanded: the number of boxes expanded so far
+
+    """
+
+    def __init__(self, ws, src_p, dest_p, src, dest):
+        self.ws = ws
+        self.src_p = src_p
+        self.dest_p = dest_p
+        self.dest = dest
+        self.corridor = None
+        self.expanded = 0
+        self.cost = {src: 0.}
+        self.back = {src: -1}
+        self.detail = {src: tuple(src_p)}
+        self.bound = {}
+        self.closed = set()
+        self.best = src
+        self.best_h = sqrt((src_p[0] - dest_p[0]) ** 2 + (src_p[1] - dest_p[1]) ** 2)
+        self.queue = [(self.best_h, src)]
+        self.done = src < 0 or dest < 0
+
+    def step(self, expansions=None, seconds=None):
+        """ Advances the search until it finishes or a budget runs out.
+
+        Args:
+            expansions: the most boxes to expand, or None for no limit
+            seconds: the most time to spend, or None for no limit; the clock is
+                read every CHECK_INTERVAL expansions, so it can be overrun slightly
+
+        Returns:
+            Whether the search has finished.
+
+        """
+        if self.done:
+            return True
+        limit = inf if expansions is None else expansions
+        deadline = inf if seconds is None else perf_counter() + seconds
+
+        ws = self.ws
+        portals = ws.portals
+        offsets = ws.offsets
+        neighbors = ws.neighbors
+        rows = ws.landmark_rows
+        goal_row = None if rows is None else rows[self.dest]
+        queue = self.queue
+        closed = self.closed
+        cost = self.cost
+        back = self.back
+        detail = self.detail
+        bound = self.bound
+        dest = self.dest
+        gx, gy = self.dest_p
+        best_h = self.best_h
+
+        count = 0
+        while queue and count < limit:
+            if count % CHECK_INTERVAL == 0 and perf_counter() >= deadline:
+                break
+            _, cell = heappop(queue)
+            if cell in closed:
+                continue
+            closed.add(cell)
+            count += 1
+
+            if cell == dest:
+                self.corridor = self.corridor_to(dest)
+                self.done = True
+                break
+
+            cx, cy = detail[cell]
+            h = sqrt((cx - gx) ** 2 + (cy - gy) ** 2)
+            if h < best_h:
+                best_h = h
+                self.best = cell
+            cell_cost = cost[cell]
+
+            for k in range(offsets[cell], offsets[cell + 1]):
+                child = neighbors[k]
+                if child in closed:
+                    continue
+
+                p = 4 * k
+                lo = portals[p]
+                hi = portals[p + 1]
+                nx = lo if cx < lo else hi if cx > hi else cx
+                lo = portals[p + 2]
+                hi = portals[p + 3]
+                ny = lo if cy < lo else hi if cy > hi else cy
+
+                cost_to_child = cell_cost + sqrt((nx - cx) ** 2 + (ny - cy) ** 2)
+                if child not in cost:
+                    if goal_row is not None:
+                        bound[child] = lower_bound(rows[child], goal_row)
+                elif cost_to_child >= cost[child]:
+                    continue
+
+                cost[child] = cost_to_child
+                back[child] = cell
+                detail[child] = (nx, ny)
+                h = sqrt((nx - gx) ** 2 + (ny - gy) ** 2)
+                if goal_row is not None and bound[child] > h:
+                    h = bound[child]
+                heappush(queue, (cost_to_child + h, child))
+
+        self.best_h = best_h
+        self.expanded += count
+        if not queue:
+            self.done = True
+        return self.done
+
+    def corridor_to(self, cell):
+        """ Follows backpointers from a reached box to src. """
+        back = self.back
+        path = []
+        while cell != -1:
+            path.append(cell)
+            cell = back[cell]
+        path.reverse()
+        return path
+
+    def partial_corridor(self):
+        """ Returns the corridor to dest if it was found, else the corridor to the
+        expanded box closest to dest_p so far. """
+        if self.corridor is not None:
+            return self.corridor
+        return self.corridor_to(self.best)
+
+    def path(self):
+        """ Returns the points of the path found, those of the partial corridor
+        while the search is unfinished, or [] if it finished without a path. """
+        if self.corridor is not None:
+            return [self.detail[i] for i in self.corridor] + [self.dest_p]
+        if self.done:
+            return []
+        return [self.detail[i] for i in self.partial_corridor()]
+
+
+class SearchScheduler:
+    """ Advances many AnytimeSearches round-robin under one shared budget.
+
+    Each call to step hands out slices of slice_expansions expansions, one
+    search at a time, and picks up the next call where the last one stopped, so
+    every search progresses however small the budget of a frame is.
+
+    Args:
+        slice_expansions: the expansions a search gets per turn
+
+    """
+
+    def __init__(self, slice_expansions=64):
+        self.slice_expansions = slice_expansions
+        self.searches = deque()
+
+    def __len__(self):
+        return len(self.searches)
+
+    def add(self, search):
+        self.searches.append(search)
+
+    def step(self, expansions=None, seconds=None):
+        """ Advances the searches until the budget runs out or all of them finish.
+
+        Args:
+            expansions: the most boxes to expand in total, or None for no limit
+            seconds: the most time to spend in total, or None for no limit
+
+        Returns:
+            The list of searches that finished, which are no longer scheduled.
+
+        """
+        searches = self.searches
+        deadline = inf if seconds is None else perf_counter() + seconds
+        left = inf if expansions is None else expansions
+        finished = []
+        while searches and left > 0:
+            remaining = deadline - perf_counter()
+            if remaining <= 0:
+                break
+            search = searches[0]
+            before = search.expanded
+            done = search.step(min(self.slice_expansions, left), None if deadline == inf else remaining)
+            left -= search.expanded - before
+            if done:
+                searches.popleft()
+                finished.append(search)
+            else:
+                searches.rotate(-1)
+        return finished
+
+
+# how many meshes keep their workspace; the least recently used is dropped past that
+WORKSPACE_CACHE_SIZE = 8
+
+_workspaces = OrderedDict()
+
+
+def workspace(mesh, copy=None):
+    """ Returns the SearchWorkspace for a mesh, creating it on first use.
+
+    Workspaces are keyed by the identity of the mesh object, and hold on to it so
+    that identity can't be reused by another mesh while it is cached. Only the
+    WORKSPACE_CACHE_SIZE most recently used meshes keep theirs, so dropped meshes
+    are freed. They are rebuilt when the mesh's 'version' changes (see
+    nm_meshbuilder.rebuild_region).
+
+    Args:
+        mesh: A dict mesh or an ArrayMesh.
+        copy: Whether the workspace copies the mesh arrays into lists (see
+            SearchWorkspace); None takes the cached workspace either way, and
+            creates one that copies.
+
+    """
+    version = mesh.get('version', 0)
+    key = id(mesh)
+    entry = _workspaces.get(key)
+    if entry is None or entry[0] is not mesh or entry[1] != version or \
+            (copy is not None and entry[2].copy != copy):
+        entry = (mesh, version, SearchWorkspace(mesh, True if copy is None else copy))
+        _workspaces[key] = entry
+    _workspaces.move_to_end(key)
+    while len(_workspaces) > WORKSPACE_CACHE_SIZE:
+        _workspaces.popitem(last=False)
+    return entry[2]
@@ -0,0 +1,413 @@
+""" A local path query service, for embedding nm_pathfinder in a game server.
+
+The server loads each mesh once, copies its arrays into
+multiprocessing.shared_memory blocks, and answers find_path queries in a pool
+of worker processes that map those blocks instead of unpickling the mesh.
+
+Queries are newline-delimited JSON over a Unix socket or a localhost TCP port:
+
+    {"id": 1, "mesh": "homer.png.mesh", "src": [x, y], "dst": [x, y],
+     "engine": "array", "timeout": 0.25}
+
+"engine" and "timeout" (seconds) are optional. Several queries can be sent as one
+message, {"batch": [query, ...]}. Each query gets its own reply, in the order the
+queries finish:
+
+    {"id": 1, "path": [[x, y], ...], "boxes": 12}
+    {"id": 1, "error": "deadline exceeded"}
+
+Queries for the same mesh that arrive within --batch-window of each other are sent
+to a worker together, up to --batch-size of them, so that many short queries
+share the cost of a round trip to the pool. A query past its deadline is answered
+with an error and skipped by the worker if it hasn't started it yet.
+
+Usage:
+    python nm_server.py serve --socket /tmp/nm.sock map.png.mesh.pickle [...]
+    python nm_server.py query --socket /tmp/nm.sock map.png.mesh x1 y1 x2 y2
+
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy
+
+import nm_meshio
+import nm_pathfinder
+import nm_search
+
+DEFAULT_PORT = 7878
+DEFAULT_ENGINE = 'array'
+
+
+def mesh_name(filename):
+    """ Returns the name clients use for a mesh file, e.g. 'map.png.mesh'. """
+    name = os.path.basename(filename)
+    return name[:-len('.pickle')] if name.endswith('.pickle') else name
+
+
+def share_mesh(mesh):
+    """ Copies the arrays of a mesh into shared memory blocks.
+
+    Args:
+        mesh: A dict mesh or an ArrayMesh.
+
+    Returns:
+        The list of SharedMemory blocks, which the caller must keep open and
+        unlink once done, and a picklable description of the arrays that
+        attach_mesh turns back into an ArrayMesh in another process.
+
+    """
+    blocks = []
+    layout = {}
+    arrays = dict(nm_meshio.from_dict(mesh).arrays)
+    # computed once here, rather than by every worker
+    if 'portals' not in arrays:
+        arrays['portals'] = nm_meshio.build_portals(nm_meshio.ArrayMesh(arrays))
+    for name, array in arrays.items():
+        array = numpy.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        numpy.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        layout[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, layout
+
+
+def attach_block(name):
+    """ Opens a shared memory block created by another process, without taking ownership of it.
+
+    Before Python 3.13, opening a block registers it with the resource tracker,
+    which unlinks it, with a "leaked shared_memory objects" warning, when the
+    process exits. Unregistering it afterwards isn't enough: processes started
+    by the server share its tracker, which would then lose the owner's
+    registration too. So registration is skipped while the block is opened.
+
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def attach_mesh(layout):
+    """ Maps the shared memory blocks described by share_mesh as a read-only ArrayMesh.
+
+    Only the process that called share_mesh unlinks the blocks.
+
+    Returns:
+        The ArrayMesh and the list of SharedMemory blocks backing it.
+
+    """
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in layout.items():
+        block = attach_block(block_name)
+        array = numpy.ndarray(shape, numpy.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        blocks.append(block)
+        arrays[name] = array
+    return nm_meshio.ArrayMesh(arrays), blocks
+
+
+# meshes mapped by a worker process, by name
+_worker_meshes = None
+
+
+def _init_query_worker(layouts):
+    global _worker_meshes
+    # Ctrl-C is for the server, which shuts the pool down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_meshes = {name: attach_mesh(layout) for name, layout in layouts.items()}
+    for mesh, _ in _worker_meshes.values():
+        nm_search.workspace(mesh, copy=False)
+
+
+def _run_queries(name, queries):
+    """ Answers a batch of queries on one mesh in a worker process.
+
+    Args:
+        name: The name of the mesh.
+        queries: A list of (src, dst, engine, deadline) tuples, the deadline
+            being a time.monotonic() value or None.
+
+    Returns:
+        A reply dict (without id) for each query.
+
+    """
+    mesh = _worker_meshes[name][0]
+    # search the shared arrays in place rather than copying them into lists
+    nm_search.workspace(mesh, copy=False)
+    replies = []
+    for src, dst, engine, deadline in queries:
+        if deadline is not None and time.monotonic() > deadline:
+            replies.append({'error': 'deadline exceeded'})
+            continue
+        try:
+            path, boxes = nm_pathfinder.find_path(tuple(src), tuple(dst), mesh, engine)
+        except Exception as e:
+            replies.append({'error': '%s: %s' % (type(e).__name__, e)})
+            continue
+        replies.append({'path': [[float(x), float(y)] for x, y in path], 'boxes': len(boxes)})
+    return replies
+
+
+class PathServer:
+    """ Serves find_path queries on shared meshes from a pool of worker processes.
+
+    Args:
+        meshes: A dict from names to meshes (dict meshes or ArrayMeshes).
+        workers: The number of worker processes.
+        batch_size: The most queries sent to a worker at once.
+        batch_window: Seconds to wait for more queries on the same mesh before
+            sending a partial batch.
+
+    """
+
+    def __init__(self, meshes, workers=os.cpu_count(), batch_size=32, batch_window=0.002):
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.blocks = []
+        layouts = {}
+        for name, mesh in meshes.items():
+            blocks, layouts[name] = share_mesh(mesh)
+            self.blocks.extend(blocks)
+        self.names = set(layouts)
+        # spawned workers inherit nothing, so the shared blocks are all they get of the meshes
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            workers, multiprocessing.get_context('spawn'), _init_query_worker, (layouts,))
+        self.pending = {}
+        self.timers = {}
+
+    def close(self):
+        """ Stops the workers and frees the shared memory. """
+        self.pool.shutdown(cancel_futures=True)
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    async def query(self, request):
+        """ Answers one query dict, waiting at most its timeout. """
+        if not isinstance(request, dict):
+            return {'id': None, 'error': 'a query must be a JSON object'}
+        reply = {'id': request.get('id')}
+        name = request.get('mesh')
+        if name not in self.names:
+            reply['error'] = 'unknown mesh: %r' % (name,)
+            return reply
+        try:
+            src = [float(v) for v in request['src']]
+            dst = [float(v) for v in request['dst']]
+        except (KeyError, TypeError, ValueError):
+            reply['error'] = 'src and dst must be [x, y] points'
+            return reply
+
+        timeout = request.get('timeout')
+        if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))):
+            reply['error'] = 'timeout must be a number of seconds'
+            return reply
+        deadline = None if timeout is None else time.monotonic() + timeout
+        future = asyncio.get_running_loop().create_future()
+        self.submit(name, (src, dst, request.get('engine', DEFAULT_ENGINE), deadline), future)
+        try:
+            reply.update(await asyncio.wait_for(future, timeout))
+        except asyncio.TimeoutError:
+            reply['error'] = 'deadline exceeded'
+        return reply
+
+    def submit(self, name, query, future):
+        pending = self.pending.setdefault(name, [])
+        pending.append((query, future))
+        if len(pending) >= self.batch_size:
+            self.flush(name)
+        elif name not in self.timers:
+            self.timers[name] = asyncio.get_running_loop().call_later(self.batch_window, self.flush, name)
+
+    def flush(self, name):
+        """ Sends the pending queries on a mesh to the pool. """
+        timer = self.timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+        # queries whose deadline already passed have been answered
+        batch = [(query, future) for query, future in self.pending.pop(name, []) if not future.done()]
+        if not batch:
+            return
+
+        def done(result):
+            if result.cancelled():
+                return
+            error = result.exception()
+            replies = [{'error': '%s: %s' % (type(error).__name__, error)}] * len(batch) if error else result.result()
+            for (_, future), reply in zip(batch, replies):
+                if not future.done():
+                    future.set_result(reply)
+
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor(self.pool, _run_queries, name, [query for query, _ in batch]).add_done_callback(done)
+
+    async def handle(self, reader, writer):
+        """ Answers the queries of one client connection. """
+        tasks = set()
+
+        async def answer(request):
+            reply = await self.query(request)
+            writer.write(json.dumps(reply).encode() + b'\n')
+            await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    writer.write(json.dumps({'id': None, 'error': 'invalid JSON'}).encode() + b'\n')
+                    continue
+                requests = message.get('batch', [message]) if isinstance(message, dict) else [message]
+                if not isinstance(requests, list):
+                    writer.write(json.dumps({'id': None, 'error': 'batch must be a list of queries'}).encode() + b'\n')
+                    continue
+                for request in requests:
+                    task = asyncio.ensure_future(answer(request))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None, port=DEFAULT_PORT):
+        """ Listens on a Unix socket if socket_path is given, or else on localhost:port, until cancelled. """
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle, socket_path)
+        else:
+            server = await asyncio.start_server(self.handle, '127.0.0.1', port)
+        async with server:
+            await server.serve_forever()
+
+
+class PathClient:
+    """ An asyncio client for PathServer.
+
+    Queries can be sent concurrently over one connection; replies are matched
+    to them by id.
+
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+        self.waiting = {}
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    @classmethod
+    async def connect(cls, socket_path=None, port=DEFAULT_PORT):
+        if socket_path is not None:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+        else:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        return cls(reader, writer)
+
+    async def receive(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            reply = json.loads(line)
+            future = self.waiting.pop(reply.get('id'), None)
+            if future is not None and not future.done():
+                future.set_result(reply)
+        for future in self.waiting.values():
+            future.set_exception(ConnectionError("connection closed"))
+
+    def request(self, mesh, src, dst, engine=None, timeout=None):
+        self.next_id += 1
+        request = {'id': self.next_id, 'mesh': mesh, 'src': list(src), 'dst': list(dst)}
+        if engine is not None:
+            request['engine'] = engine
+        if timeout is not None:
+            request['timeout'] = timeout
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.next_id] = future
+        return request, future
+
+    async def find_path(self, mesh, src, dst, engine=None, timeout=None):
+        """ Sends one query and returns its reply dict. """
+        request, future = self.request(mesh, src, dst, engine, timeout)
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        return await future
+
+    async def find_paths(self, mesh, pairs, engine=None, timeout=None):
+        """ Sends queries for a list of (src, dst) pairs as one batch and returns their replies in order. """
+        requests, futures = zip(*(self.request(mesh, src, dst, engine, timeout) for src, dst in pairs))
+        self.writer.write(json.dumps({'batch': list(requests)}).encode() + b'\n')
+        return list(await asyncio.gather(*futures))
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+
+
+async def run_server(args):
+    meshes = {mesh_name(f): nm_meshio.load_mesh(f) for f in args.meshes}
+    server = PathServer(meshes, args.workers, args.batch_size, args.batch_window)
+    try:
+        print("serving %s on %s" % (', '.join(sorted(meshes)), args.socket or '127.0.0.1:%d' % args.port),
+              file=sys.stderr)
+        await server.serve(args.socket, args.port)
+    finally:
+        server.close()
+
+
+async def run_query(args):
+    client = await PathClient.connect(args.socket, args.port)
+    try:
+        reply = await client.find_path(args.mesh, (args.x1, args.y1), (args.x2, args.y2), args.engine, args.timeout)
+    finally:
+        await client.close()
+    print(json.dumps(reply))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Serves nm_pathfinder queries on shared meshes.")
+    parser.add_argument('--socket', help="Unix socket path (default: a localhost TCP port)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help="load meshes and answer queries")
+    serve.add_argument('meshes', nargs='+', help=".mesh.pickle files or array mesh prefixes")
+    serve.add_argument('--workers', type=int, default=os.cpu_count())
+    serve.add_argument('--batch-size', type=int, default=32)
+    serve.add_argument('--batch-window', type=float, default=0.002, help="seconds")
+
+    query = commands.add_parser('query', help="send one query to a running server")
+    query.add_argument('mesh')
+    query.add_argument('x1', type=float)
+    query.add_argument('y1', type=float)
+    query.add_argument('x2', type=float)
+    query.add_argument('y2', type=float)
+    query.add_argument('--engine')
+    query.add_argument('--timeout', type=float)
+
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_server(args) if args.command == 'serve' else run_query(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,108 @@
+""" Opt-in instrumentation of path queries.
+
+Pass a SearchStats to nm_pathfinder.find_path (or a callable, such as
+StatsAggregator.record, that receives one per query) to see where a query
+spends its time and how much work its search did. Without it, the searches only
+pay for a few len() calls per expanded box.
+
+"""
+import sys
+
+import numpy
+
+# counters that SearchStats records, in the order they are reported
+FIELDS = ('lookup_s', 'search_s', 'reconstruct_s', 'reached', 'expanded', 'pushes', 'pops',
+          'stale', 'find_detail_calls', 'frontier_forward', 'frontier_backward')
+
+
+class SearchStats:
+    """ What one query did.
+
+    Attributes:
+        engine: The engine that answered the query.
+        found: Whether a path was found.
+        lookup_s: Seconds spent finding the boxes of both endpoints.
+        search_s: Seconds spent searching, reconstruction excluded.
+        reconstruct_s: Seconds spent turning the search's result into points.
+        reached: Number of boxes the search returned as explored.
+        expanded: Number of boxes whose neighbors the search went through.
+        pushes, pops: Heap operations.
+        stale: Popped heap entries skipped because their box was already
+            expanded at a cost at least as low.
+        find_detail_calls: Calls to find_detail.
+        frontier_forward, frontier_backward: The largest number of entries in
+            the heap for each direction of the search.
+
+    Counters an engine doesn't measure are left as None.
+
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Clears everything recorded, for the next query. """
+        self.engine = None
+        self.found = False
+        for name in FIELDS:
+            setattr(self, name, None)
+
+    def as_dict(self):
+        result = {'engine': self.engine, 'found': self.found}
+        result.update((name, getattr(self, name)) for name in FIELDS)
+        return result
+
+    def __repr__(self):
+        return 'SearchStats(%s)' % ', '.join('%s=%r' % item for item in self.as_dict().items())
+
+
+class StatsAggregator:
+    """ Collects the SearchStats of many queries and summarizes them as histograms.
+
+    Its record method can be passed directly as find_path's stats argument.
+
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.found = 0
+        self.values = {name: [] for name in FIELDS}
+
+    def record(self, stats):
+        self.queries += 1
+        self.found += bool(stats.found)
+        for name in FIELDS:
+            value = getattr(stats, name)
+            if value is not None:
+                self.values[name].append(value)
+
+    def histogram(self, name, bins=10):
+        """ Returns the histogram of a field as a list of (low, high, count) bins. """
+        values = self.values[name]
+        if not values:
+            return []
+        counts, edges = numpy.histogram(values, bins=bins)
+        return [(float(edges[i]), float(edges[i + 1]), int(counts[i])) for i in range(len(counts))]
+
+    def as_dict(self, bins=10):
+        result = {'queries': self.queries, 'found': self.found, 'fields': {}}
+        for name in FIELDS:
+            values = self.values[name]
+            if values:
+                result['fields'][name] = {'count': len(values), 'mean': float(numpy.mean(values)),
+                                          'max': float(numpy.max(values)), 'histogram': self.histogram(name, bins)}
+        return result
+
+    def dump(self, file=sys.stdout, bins=10, width=40):
+        """ Prints a text histogram of every field that was recorded. """
+        print("%d queries, %d found" % (self.queries, self.found), file=file)
+        for name in FIELDS:
+            histogram = self.histogram(name, bins)
+            if not histogram:
+                continue
+            values = self.values[name]
+            print("\n%s  (mean %.6g, max %.6g)" % (name, numpy.mean(values), numpy.max(values)), file=file)
+            peak = max(count for _, _, count in histogram)
+            for low, high, count in histogram:
+                bar = '#' * (count * width // peak if peak else 0)
+                print("  %12.6g - %-12.6g %6d %s" % (low, high, count, bar), file=file)
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+sys.path.insert(0, SRC_DIR)
+
+import nm_meshio  # noqa: E402
+
+# the shipped meshes with integer box coordinates
+MESH_NAMES = ['homer.png', 'gran-turismo-logo-w-and-b.png', 'ucsc_banana_slug.png']
+
+
+def input_mesh(name):
+    """ Loads input/<name>.mesh.pickle and gives it a label raster. """
+    mesh = nm_meshio.load_mesh(os.path.join(INPUT_DIR, name + '.mesh.pickle'))
+    if mesh.get('labels') is None:
+        shape = (max(b[1] for b in mesh['boxes']) + 1, max(b[3] for b in mesh['boxes']) + 1)
+        mesh['labels'] = nm_meshio.build_labels(mesh, shape)
+    return mesh
+
+
+@pytest.fixture(params=MESH_NAMES)
+def mesh(request):
+    return input_mesh(request.param)
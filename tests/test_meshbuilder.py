@@ -0,0 +1,62 @@
+import os
+import random
+
+import numpy
+import pytest
+from matplotlib.pyplot import imread
+
+import nm_meshbuilder
+import nm_meshio
+from conftest import INPUT_DIR, MESH_NAMES
+
+MIN_FEATURE_SIZE = 16
+
+
+def load_image(name):
+    image = (imread(os.path.join(INPUT_DIR, name)) * 255).astype(dtype=numpy.uint8)
+    return image[:, :, 0] if len(image.shape) > 2 else image
+
+
+def same_partition(a, b):
+    """ Tells whether two arrays of ids group their positions the same way. """
+    pairs = set(zip(a.tolist(), b.tolist()))
+    return len(pairs) == len(set(a.tolist())) == len(set(b.tolist()))
+
+
+def edit(image, rnd):
+    h, w = rnd.randrange(5, 150), rnd.randrange(5, 150)
+    x, y = rnd.randrange(0, image.shape[0] - h), rnd.randrange(0, image.shape[1] - w)
+    kind = rnd.choice(['wall', 'open', 'noise'])
+    if kind == 'wall':
+        image[x:x + h, y:y + w] = 0
+    elif kind == 'open':
+        image[x:x + h, y:y + w] = 255
+    else:
+        image[x:x + h, y:y + w] = numpy.where(numpy.random.RandomState(rnd.randrange(1 << 30)).rand(h, w) < 0.3, 0, 255)
+    return (x, x + h, y, y + w)
+
+
+@pytest.mark.parametrize('name', MESH_NAMES)
+@pytest.mark.parametrize('seed', [0, 14])
+def test_rebuild_region_matches_build_mesh(name, seed):
+    rnd = random.Random(seed)
+    image = load_image(name)
+    mesh = nm_meshbuilder.build_mesh(image, MIN_FEATURE_SIZE)
+    mesh['labels'] = nm_meshio.build_labels(mesh, image.shape)
+    for _ in range(5):
+        rect = edit(image, rnd)
+        nm_meshbuilder.rebuild_region(mesh, image, rect, MIN_FEATURE_SIZE)
+        labels = mesh['labels']
+
+        assert set(mesh['adj']) == set(mesh['boxes'])
+        assert (labels == nm_meshio.build_labels(mesh, image.shape)).all()
+        for x1, x2, y1, y2 in mesh['boxes']:
+            assert (image[x1:x2, y1:y2] == 255).all()
+        components = numpy.asarray(mesh['components'])
+        assert same_partition(components, nm_meshio.build_components(mesh))
+
+        full = nm_meshbuilder.build_mesh(image, MIN_FEATURE_SIZE)
+        full_labels = nm_meshio.build_labels(full, image.shape)
+        covered = labels >= 0
+        assert (covered == (full_labels >= 0)).all()
+        assert same_partition(components[labels[covered]], numpy.asarray(full['components'])[full_labels[covered]])
@@ -0,0 +1,37 @@
+import os
+import shutil
+
+import numpy
+
+import nm_meshio
+from conftest import INPUT_DIR
+
+
+def converted(name, tmp_path):
+    """ Converts a copy of input/<name>.mesh.pickle in tmp_path, returning the pickled mesh and the conversion. """
+    filename = str(tmp_path / (name + '.mesh.pickle'))
+    shutil.copy(os.path.join(INPUT_DIR, name + '.mesh.pickle'), filename)
+    return nm_meshio.load_mesh(filename), nm_meshio.convert_pickle(filename)
+
+
+def assert_same_mesh(mesh, arrays):
+    assert list(arrays['boxes']) == list(mesh['boxes'])
+    for box in mesh['boxes']:
+        assert arrays['adj'][box] == list(mesh['adj'][box])
+    assert (arrays['portals'] == nm_meshio.build_portals(mesh)).all()
+    assert (arrays['components'] == nm_meshio.build_components(mesh)).all()
+
+
+def test_convert_float_pickle(tmp_path):
+    # built by an older nm_meshbuilder, with fractional box coordinates
+    mesh, arrays = converted('homer.gif', tmp_path)
+    assert arrays.boxes.dtype == numpy.float64
+    assert 'labels' not in arrays
+    assert_same_mesh(mesh, arrays)
+
+
+def test_convert_integer_pickle(tmp_path):
+    mesh, arrays = converted('homer.png', tmp_path)
+    assert arrays.boxes.dtype == numpy.int32
+    assert (arrays['labels'] == nm_meshio.build_labels(mesh, arrays['labels'].shape)).all()
+    assert_same_mesh(mesh, arrays)
@@ -0,0 +1,89 @@
+""" Differential test of nba_corridor against a_star_shortest_path.
+
+Both are compared on one cost: the sum of the distances between the centers of
+consecutive boxes of a corridor, which nba_corridor minimizes. The corridor of
+a_star_shortest_path isn't returned, only its detail points, one per box, so
+its cost is taken as that of the cheapest corridor through boxes that contain
+those points in turn; its actual corridor is one of them.
+
+"""
+from heapq import heappop, heappush
+from math import inf
+
+import nm_benchmark
+import nm_pathfinder
+
+
+def step(a, b):
+    return nm_pathfinder.euclidean_dist(nm_pathfinder.box_center(a), nm_pathfinder.box_center(b))
+
+
+def corridor_cost(corridor):
+    return sum(step(a, b) for a, b in zip(corridor, corridor[1:]))
+
+
+def contains(box, point):
+    return box[0] <= point[0] <= box[1] and box[2] <= point[1] <= box[3]
+
+
+def points_corridor_cost(mesh, src_box, dest_box, points):
+    """ The cost of the cheapest corridor whose k-th box contains points[k]. """
+    costs = {src_box: 0.}
+    for point in points[1:]:
+        next_costs = {}
+        for box, cost in costs.items():
+            for child in mesh['adj'][box]:
+                if contains(child, point) and cost + step(box, child) < next_costs.get(child, inf):
+                    next_costs[child] = cost + step(box, child)
+        costs = next_costs
+    return costs.get(dest_box, inf)
+
+
+def dijkstra(mesh, src_box, dest_box):
+    costs = {src_box: 0.}
+    queue = [(0., src_box)]
+    closed = set()
+    while queue:
+        cost, box = heappop(queue)
+        if box in closed:
+            continue
+        closed.add(box)
+        if box == dest_box:
+            return cost
+        for child in mesh['adj'][box]:
+            if cost + step(box, child) < costs.get(child, inf):
+                costs[child] = cost + step(box, child)
+                heappush(queue, (costs[child], child))
+    return inf
+
+
+def test_nba_against_a_star(mesh):
+    for src, dst in nm_benchmark.random_pairs(mesh, 60, 3):
+        src_box = nm_pathfinder.find_box(src, mesh)
+        dest_box = nm_pathfinder.find_box(dst, mesh)
+        points, _ = nm_pathfinder.a_star_shortest_path(src, dst, src_box, dest_box, mesh)
+        corridor, _ = nm_pathfinder.nba_corridor(src_box, dest_box, mesh)
+        assert (corridor is None) == (not points)
+        if corridor is None:
+            continue
+
+        assert corridor[0] == src_box and corridor[-1] == dest_box
+        assert all(b in mesh['adj'][a] for a, b in zip(corridor, corridor[1:]))
+        cost = corridor_cost(corridor)
+        # a_star_shortest_path's points end with dst, which is not a box's detail point
+        a_star_cost = points_corridor_cost(mesh, src_box, dest_box, points[:-1])
+        assert a_star_cost < inf
+        assert cost <= a_star_cost + 1e-9
+        assert abs(cost - dijkstra(mesh, src_box, dest_box)) < 1e-9 * max(1., cost)
+
+
+def test_nba_star_path_ends(mesh):
+    found = 0
+    for src, dst in nm_benchmark.random_pairs(mesh, 10, 4):
+        src_box = nm_pathfinder.find_box(src, mesh)
+        path, boxes = nm_pathfinder.nba_star(src, dst, src_box, nm_pathfinder.find_box(dst, mesh), mesh)
+        if path:
+            found += 1
+            assert path[0] == src and path[-1] == dst
+            assert src_box in boxes
+    assert found
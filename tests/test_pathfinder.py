@@ -0,0 +1,87 @@
+import os
+import random
+
+import nm_benchmark
+import nm_meshio
+import nm_pathfinder
+import nm_stats
+from conftest import INPUT_DIR
+
+
+def test_box_index_matches_boxes(mesh):
+    # overlapping boxes of legacy meshes leave some corner pixels labeled with another box
+    for box in mesh['boxes']:
+        assert mesh['boxes'][nm_pathfinder.box_index(box, mesh)] == box
+
+
+def test_engines_accept_float_boxes():
+    # built by an older nm_meshbuilder, with fractional box coordinates
+    mesh = nm_meshio.load_mesh(os.path.join(INPUT_DIR, 'homer.gif.mesh.pickle'))
+    for box in mesh['boxes']:
+        assert mesh['boxes'][nm_pathfinder.box_index(box, mesh)] == box
+
+    pairs = nm_benchmark.random_pairs(mesh, 30, 0)
+    expected = [bool(nm_pathfinder.find_path(a, b, mesh)[0]) for a, b in pairs]
+    assert any(expected)
+    cache = nm_pathfinder.PathCache()
+    for engine in ['array', 'hpa', 'nba', 'cache']:
+        for (a, b), found in zip(pairs, expected):
+            if engine == 'cache':
+                path, _ = nm_pathfinder.find_path(a, b, mesh, cache=cache)
+            else:
+                path, _ = nm_pathfinder.find_path(a, b, mesh, engine=engine)
+            assert bool(path) == found
+            if path:
+                assert path[0] == a and path[-1] == b
+    assert [bool(path) for path in nm_pathfinder.find_paths(pairs, mesh)] == expected
+
+
+def path_length(path):
+    return sum(nm_pathfinder.euclidean_dist(a, b) for a, b in zip(path, path[1:]))
+
+
+def test_find_paths_as_long_as_find_path(mesh):
+    # crowds of agents leaving from the same points, which share search trees,
+    # among agents scattered over the same boxes, which don't; trees rooted
+    # between the scattered points gave paths up to half as long again
+    rnd = random.Random(0)
+    boxes = sorted(mesh['boxes'], key=lambda b: (b[1] - b[0]) * (b[3] - b[2]), reverse=True)[:20]
+
+    def point(box):
+        return (rnd.uniform(box[0], box[1]), rnd.uniform(box[2], box[3]))
+
+    pairs = []
+    for source_box in rnd.sample(boxes, 4):
+        spawn = point(source_box)
+        for _ in range(3 * nm_pathfinder.TREE_MIN_GROUP):
+            pairs.append((spawn if rnd.random() < 0.5 else point(source_box), point(rnd.choice(mesh['boxes']))))
+
+    ratios = []
+    for (a, b), path in zip(pairs, nm_pathfinder.find_paths(pairs, mesh)):
+        expected, _ = nm_pathfinder.find_path(a, b, mesh, engine='array')
+        assert bool(path) == bool(expected)
+        if path:
+            assert path[0] == a and path[-1] == b
+            ratios.append(path_length(path) / path_length(expected))
+    assert max(ratios) <= 1.2
+    assert sum(ratios) / len(ratios) <= 1.01
+
+
+def test_search_stats_reused_between_queries(mesh):
+    rnd = random.Random(0)
+    boxes = list(mesh['boxes'])
+    stats = nm_stats.SearchStats()
+    for _ in range(20):
+        a = nm_pathfinder.box_center(rnd.choice(boxes))
+        b = nm_pathfinder.box_center(rnd.choice(boxes))
+        path, reached = nm_pathfinder.find_path(a, b, mesh, stats=stats)
+        if path:
+            # every pop expands its box, but the one where both directions meet
+            assert stats.pops == stats.expanded + 1
+            assert stats.stale == 0
+            assert stats.reached == len(reached)
+
+        nm_pathfinder.find_path(a, b, mesh, engine='array', stats=stats)
+        assert stats.engine == 'array'
+        assert stats.reconstruct_s is None and stats.expanded is None and stats.pops is None
+        assert stats.search_s >= 0
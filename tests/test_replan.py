@@ -0,0 +1,83 @@
+import gc
+import random
+from heapq import heappop, heappush
+from math import inf
+
+import nm_benchmark
+import nm_replan
+
+
+def dijkstra(overlay, src, dst):
+    """ The cost of the cheapest route between two box ids through the overlay, from scratch. """
+    costs = {dst: 0.}
+    queue = [(0., dst)]
+    closed = set()
+    while queue:
+        cost, u = heappop(queue)
+        if u in closed:
+            continue
+        closed.add(u)
+        if u == src:
+            return cost
+        for v in overlay.edge_ids(u):
+            cost_to_v = cost + overlay.cost(u, v)
+            if cost_to_v < costs.get(v, inf):
+                costs[v] = cost_to_v
+                heappush(queue, (cost_to_v, v))
+    return inf
+
+
+def corridor_cost(overlay, corridor):
+    return sum(overlay.cost(u, v) for u, v in zip(corridor, corridor[1:])) if corridor else inf
+
+
+def test_replanning_matches_dijkstra(mesh):
+    rnd = random.Random(0)
+    overlay = nm_replan.MeshOverlay(mesh)
+    for src, dst in nm_benchmark.random_pairs(mesh, 8, 1):
+        replanner = nm_replan.Replanner(overlay, src, dst)
+        corridor = replanner.corridor()
+        for _ in range(8):
+            if corridor and len(corridor) > 2:
+                box = rnd.choice(corridor[1:-1])
+                kind = rnd.random()
+                if kind < 0.4:
+                    overlay.block_box(box)
+                elif kind < 0.7:
+                    overlay.set_box_cost(box, rnd.uniform(1, 5))
+                else:
+                    overlay.block_edge(box, rnd.choice(list(overlay.edge_ids(box))))
+            if overlay.box_factor and rnd.random() < 0.3:
+                overlay.unblock_box(rnd.choice(list(overlay.box_factor)))
+            if corridor and len(corridor) > 3 and rnd.random() < 0.5:
+                x1, x2, y1, y2 = overlay.boxes[corridor[1]]
+                replanner.move_to(((x1 + x2) / 2, (y1 + y2) / 2))
+
+            corridor = replanner.corridor()
+            expected = dijkstra(overlay, replanner.start, replanner.goal)
+            cost = corridor_cost(overlay, corridor)
+            assert cost == expected or abs(cost - expected) < 1e-6 * expected
+            if corridor:
+                path = replanner.path()
+                assert path[0] == replanner.point and path[-1] == dst
+
+        for box in list(overlay.box_factor):
+            overlay.unblock_box(box)
+        for a, b in list(overlay.edge_factor):
+            overlay.unblock_edge(a, b)
+
+
+def test_changes_are_not_kept_after_replanning(mesh):
+    overlay = nm_replan.MeshOverlay(mesh)
+    (src, dst), = nm_benchmark.random_pairs(mesh, 1, 2)
+    replanner = nm_replan.Replanner(overlay, src, dst)
+    for box in range(50):
+        overlay.set_box_cost(box, 2)
+    assert replanner.dirty
+    replanner.replan()
+    assert not replanner.dirty
+    assert overlay.version == 50
+
+    del replanner
+    gc.collect()
+    assert len(overlay.replanners) == 0
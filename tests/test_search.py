@@ -0,0 +1,41 @@
+import gc
+import weakref
+
+import nm_benchmark
+import nm_hierarchy
+import nm_pathfinder
+import nm_search
+
+
+class Mesh(dict):
+    """ A dict mesh that can be weakly referenced. """
+
+
+def test_workspace_cache_is_bounded(mesh):
+    refs = []
+    for _ in range(nm_search.WORKSPACE_CACHE_SIZE + 5):
+        copy = Mesh(mesh)
+        refs.append(weakref.ref(copy))
+        assert nm_search.workspace(copy) is nm_search.workspace(copy)
+        del copy
+    gc.collect()
+    assert len(nm_search._workspaces) <= nm_search.WORKSPACE_CACHE_SIZE
+    assert sum(ref() is not None for ref in refs) <= nm_search.WORKSPACE_CACHE_SIZE
+
+
+def test_hierarchy_cache_is_bounded(mesh):
+    for _ in range(nm_hierarchy.HIERARCHY_CACHE_SIZE + 3):
+        copy = Mesh(mesh)
+        assert nm_hierarchy.hierarchy(copy) is nm_hierarchy.hierarchy(copy)
+    assert len(nm_hierarchy._hierarchies) <= nm_hierarchy.HIERARCHY_CACHE_SIZE
+
+
+def test_workspace_without_copy_gives_the_same_paths(mesh):
+    pairs = nm_benchmark.random_pairs(mesh, 30, 0)
+    copied = nm_search.SearchWorkspace(mesh)
+    shared = nm_search.SearchWorkspace(mesh, copy=False)
+    assert isinstance(shared.neighbors, memoryview) and isinstance(shared.portals, memoryview)
+    for src, dst in pairs:
+        src_box = nm_pathfinder.find_box(src, mesh)
+        dst_box = nm_pathfinder.find_box(dst, mesh)
+        assert shared.find_path(src, dst, src_box, dst_box) == copied.find_path(src, dst, src_box, dst_box)
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import nm_benchmark
+import nm_pathfinder
+import nm_server
+from conftest import SRC_DIR, input_mesh
+
+
+def expected_path(mesh, src, dst):
+    path, _ = nm_pathfinder.find_path(tuple(src), tuple(dst), mesh, 'array')
+    return [[float(x), float(y)] for x, y in path]
+
+
+def test_round_trip(tmp_path):
+    mesh = input_mesh('homer.png')
+    pairs = nm_benchmark.random_pairs(mesh, 20, 0)
+    socket_path = str(tmp_path / 'nm.sock')
+
+    async def run():
+        server = nm_server.PathServer({'homer': mesh}, workers=1)
+        task = asyncio.ensure_future(server.serve(socket_path))
+        try:
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+            client = await nm_server.PathClient.connect(socket_path)
+            single = [await client.find_path('homer', src, dst) for src, dst in pairs[:5]]
+            batch = await client.find_paths('homer', pairs)
+            expired = await client.find_paths('homer', pairs, timeout=0)
+            unknown = await client.find_path('nope', (0, 0), (1, 1))
+            await client.close()
+
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            invalid = []
+            for message in ([1, 2], {'batch': 3}, {'id': 7, 'mesh': 'homer', 'src': [0, 0], 'dst': [1, 1],
+                                                    'timeout': 'soon'}):
+                writer.write(json.dumps(message).encode() + b'\n')
+                invalid.append(json.loads(await reader.readline()))
+            writer.close()
+            return single, batch, expired, unknown, invalid
+        finally:
+            task.cancel()
+            server.close()
+
+    single, batch, expired, unknown, invalid = asyncio.run(asyncio.wait_for(run(), 120))
+    for (src, dst), reply in zip(pairs, single):
+        assert reply['path'] == expected_path(mesh, src, dst)
+    for (src, dst), reply in zip(pairs, batch):
+        assert reply['path'] == expected_path(mesh, src, dst)
+    assert all(reply['error'] == 'deadline exceeded' for reply in expired)
+    assert 'unknown mesh' in unknown['error']
+    assert all('error' in reply for reply in invalid)
+    assert invalid[2]['id'] == 7
+
+
+def test_attached_blocks_stay_with_their_owner():
+    mesh = input_mesh('homer.png')
+    blocks, layout = nm_server.share_mesh(mesh)
+    try:
+        # a separate program, with its own resource tracker, attaches and exits
+        script = ('import sys, json; sys.path.insert(0, %r); import nm_server; '
+                  'mesh, blocks = nm_server.attach_mesh(json.loads(sys.argv[1])); print(len(mesh))') % SRC_DIR
+        result = subprocess.run([sys.executable, '-c', script, json.dumps(layout)],
+                                capture_output=True, text=True, check=True)
+        assert int(result.stdout) == len(mesh['boxes'])
+        assert 'leaked' not in result.stderr
+        attached, again = nm_server.attach_mesh(layout)
+        assert len(attached) == len(mesh['boxes'])
+        for block in again:
+            block.close()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()